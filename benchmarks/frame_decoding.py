@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Compares IO sample frame decoding via precompiled decoders with the former
+per-frame format string decoding.
+
+The former path supports only one sample set per frame, so for multi-sample
+frames it's measured as decoding of the same number of single-sample frames.
+
+Usage: PYTHONPATH=. python benchmarks/frame_decoding.py [ITERATIONS]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import struct
+import sys
+import timeit
+
+from xbee.monitor.frame import checksum, decode_io_sample
+
+
+def make_frame(analog_mask=0b00001111, digital_mask=0x0001, samples=1):
+    """Builds an IO sample frame (with header and checksum)."""
+
+    data = struct.pack(b"!BQHBBHB", 0x92, 0x0013A20040A1B2C3, 0xFFFE, 0x01, samples,
+        digital_mask, analog_mask)
+
+    for sample in range(samples):
+        if digital_mask:
+            data += struct.pack(b"!H", digital_mask)
+
+        for channel in range(8):
+            if analog_mask & (1 << channel):
+                data += struct.pack(b"!H", 0x0100 + channel)
+
+    return struct.pack(b"!BH", 0x7E, len(data)) + data + struct.pack(b"!B", checksum(data))
+
+
+def legacy_decode(buf):
+    """The former decoding path."""
+
+    frame = bytes(buf)
+
+    checksum = 0xFF - ( sum(byte for byte in frame[3:-1]) & 0b11111111 )
+    if checksum != frame[-1]:
+        raise ValueError("Frame checksum mismatch.")
+
+    offset = 4
+
+    frame_format = b"!QH BB HB"
+    if offset + struct.calcsize(frame_format) > len(frame):
+        raise ValueError("End of frame has been reached.")
+
+    address, network_address, \
+    receive_options, samples_number, \
+    digital_mask, analog_mask = \
+        struct.unpack_from(frame_format, frame, offset=offset)
+    offset += struct.calcsize(frame_format)
+
+    if digital_mask:
+        digital_samples_format = b"!H"
+        digital_samples, = struct.unpack_from(
+            digital_samples_format, frame, offset=offset)
+        offset += struct.calcsize(digital_samples_format)
+
+    metrics = {}
+    analog_sample_format = b"!H"
+    analog_sample_size = struct.calcsize(analog_sample_format)
+    analog_mask_shift = 0
+
+    while analog_mask:
+        if analog_mask & 1:
+            if offset + analog_sample_size > len(frame):
+                raise ValueError("End of frame has been reached.")
+
+            analog_sample, = struct.unpack_from(
+                analog_sample_format, frame, offset=offset)
+            offset += analog_sample_size
+
+            metrics[analog_mask_shift] = analog_sample
+
+        analog_mask >>= 1
+        analog_mask_shift += 1
+
+    if offset != len(frame) - 1:
+        raise ValueError("Frame size is too big for its payload.")
+
+    return address, metrics
+
+
+def decode(buf):
+    """The current decoding path."""
+
+    frame = memoryview(buf)[3:-1]
+
+    if checksum(frame) != buf[-1]:
+        raise ValueError("Frame checksum mismatch.")
+
+    address, network_address, receive_options, digital, analog = decode_io_sample(frame)
+    return address, analog
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    for samples in (1, 10):
+        for analog_mask in (0b00000010, 0b00001111, 0b11111111):
+            legacy_buf = bytearray(make_frame(analog_mask))
+            buf = bytearray(make_frame(analog_mask, samples=samples))
+            address, analog = decode(buf)
+            assert legacy_decode(legacy_buf) == (
+                address, dict((channel, samples[0]) for channel, samples in analog.items()))
+
+            results = []
+            for func, func_buf, frames in (
+                (legacy_decode, legacy_buf, samples),
+                (decode, buf, 1),
+            ):
+                elapsed = min(timeit.repeat(
+                    lambda: [func(func_buf) for frame in range(frames)],
+                    number=iterations, repeat=3))
+                results.append(elapsed / iterations / samples * 1000000)
+
+            print("Analog mask {0:08b}, {1} sample(s) per frame: legacy {2:.2f} us/sample, "
+                  "current {3:.2f} us/sample ({4:.1f}x).".format(
+                  analog_mask, samples, results[0], results[1], results[0] / results[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Measures the effect of VMIN/VTIME read batching (see the vmin and vtime device
+settings) on the number of sensor wakeups using a pseudo-terminal fed with IO
+sample frames at the specified baud rate.
+
+Usage: PYTHONPATH=. python benchmarks/serial_batching.py [FRAMES [BAUDRATE]]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import fcntl
+import logging
+import os
+import pty
+import sys
+import threading
+import time
+import tty
+
+from xbee.common.io_loop import IoLoop
+from xbee.monitor import config, sensor
+
+from frame_decoding import make_frame
+
+
+_CHUNK_SIZE = 8
+"""Size of data chunks written to the terminal (a small USB packet)."""
+
+_SETTINGS = ((0, 0), (24, 1), (48, 1), (96, 1), (96, 3))
+"""Tested (vmin, vtime) device settings."""
+
+_HANG_UP_DELAY = 0.5
+"""Delay before hanging up the terminal (must be greater than any tested vtime)."""
+
+
+def measure(frames, baudrate, vmin, vtime):
+    """Measures sensor wakeups for the specified vmin/vtime settings."""
+
+    data = make_frame(analog_mask=0b00000010) * frames
+    bytes_per_second = baudrate / 10.0
+
+    master_fd, slave_fd = pty.openpty()
+
+    try:
+        tty.setraw(slave_fd)
+        sensor._configure_read_batching(slave_fd, vmin)
+        fcntl.fcntl(slave_fd, fcntl.F_SETFL,
+            fcntl.fcntl(slave_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        slave = os.fdopen(slave_fd, "rb", 0)
+    except:
+        os.close(master_fd)
+        os.close(slave_fd)
+        raise
+
+    def write():
+        try:
+            start_time = time.time()
+
+            for offset in range(0, len(data), _CHUNK_SIZE):
+                delay = start_time + offset / bytes_per_second - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+                os.write(master_fd, data[offset:offset + _CHUNK_SIZE])
+
+            # Let the monitor read the tail before hanging up
+            time.sleep(_HANG_UP_DELAY)
+        finally:
+            os.close(master_fd)
+
+    stats = {}
+    config.DEVICES["pty"] = dict(config.DEFAULT_DEVICE_SETTINGS, vmin=vmin, vtime=vtime)
+
+    with IoLoop() as io_loop:
+        pty_sensor = sensor._Sensor(io_loop, "pty", slave)
+        pty_sensor.add_on_close_handler(lambda: stats.update(pty_sensor.get_stats()))
+
+        writer = threading.Thread(target=write)
+        writer.start()
+
+        start_cpu_time = time.process_time()
+        io_loop.start()
+        cpu_time = time.process_time() - start_cpu_time
+
+        writer.join()
+
+    wakeups = stats["frames_per_call"]["count"]
+
+    print("VMIN={0:<3} VTIME={1}: {2} frames, {3} wakeups ({4:.2f} frames/wakeup), "
+          "{5:.1f} us of process CPU time/frame.".format(
+          vmin, vtime, stats["frames"], wakeups,
+          float(stats["frames"]) / wakeups if wakeups else 0,
+          cpu_time / max(stats["frames"], 1) * 1000000))
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    baudrate = int(sys.argv[2]) if len(sys.argv) > 2 else 115200
+
+    # Frames come from an unknown address and the pseudo-terminal is closed
+    # in the end - don't log warnings and errors about it
+    logging.basicConfig(level=logging.CRITICAL)
+
+    print("{0} frames of {1} bytes at {2} baud in {3}-byte chunks:".format(
+        frames, len(make_frame(analog_mask=0b00000010)), baudrate, _CHUNK_SIZE))
+
+    for vmin, vtime in _SETTINGS:
+        measure(frames, baudrate, vmin, vtime)
+
+
+if __name__ == "__main__":
+    main()
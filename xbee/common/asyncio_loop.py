@@ -0,0 +1,545 @@
+"""Provides an I/O main loop that runs on top of asyncio."""
+
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+import queue
+import select
+import threading
+
+from xbee.common import constants
+from xbee.common.core import Error
+from xbee.common.histogram import Histogram, TIME_BUCKETS
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncioIoLoop(object):
+    """
+    An IoLoop implementation that runs file objects on top of an asyncio event
+    loop.
+
+    By default a new asyncio event loop is created, but any loop may be passed
+    (for example a loop of a faster drop-in asyncio implementation).
+
+    asyncio has no notion of I/O priorities, so FileObject.priority is ignored.
+
+    asyncio reports hang ups only as read readiness, so after each read event
+    the file is checked for a hang up (one extra poll() system call) to deliver
+    on_hang_up() and on_error() like IoLoop does.
+    """
+
+    def __init__(self, loop=None):
+        # The underlying asyncio event loop
+        self.__loop = asyncio.new_event_loop() if loop is None else loop
+
+        # Controlled objects
+        self.__objects = {}
+
+        # Objects that don't set their interest explicitly and have to be
+        # asked about it via poll_read()/poll_write() after each event
+        self.__polled_objects = {}
+
+        # Current read/write interest of the objects
+        self.__interest = {}
+
+        # Scheduled deferred calls
+        self.__deferred_calls = set()
+
+        # Is polled objects interest update scheduled
+        self.__update_scheduled = False
+
+        # Thread pool for blocking operations (created on demand) and number
+        # of tasks that are running in it
+        self.__executor = None
+        self.__executor_tasks = 0
+
+        # Loop instrumentation
+        self.__callback_time = dict(
+            (callback, Histogram(TIME_BUCKETS))
+            for callback in ("on_read", "on_write", "on_error", "on_hang_up"))
+        self.__deferred_call_lag = Histogram(TIME_BUCKETS)
+
+        self.__stopping = False
+        self.__closed = False
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+        return False
+
+
+    @property
+    def asyncio_loop(self):
+        """The underlying asyncio event loop."""
+
+        return self.__loop
+
+
+    def close(self):
+        """Closes the object."""
+
+        if self.__closed:
+            return
+
+        self.__closed = True
+
+        # Detach all objects
+        for obj in list(self.__objects.values()):
+            obj.close()
+
+        # Break possible cycle references
+        for call in self.__deferred_calls:
+            call.handle.cancel()
+            call.func = None
+        self.__deferred_calls.clear()
+
+        if self.__executor is not None:
+            self.__executor.shutdown()
+
+        try:
+            self.__loop.close()
+        except Exception as e:
+            LOG.error("Failed to close the asyncio event loop: %s.", e)
+
+
+
+    def add_object(self, obj):
+        """Adds an object to the list of polled objects."""
+
+        self.__ensure_not_closed()
+
+        fd = obj.fileno()
+        self.__objects[fd] = obj
+        self.__polled_objects[fd] = obj
+        self.__interest[fd] = (False, False)
+        self.__schedule_update()
+
+
+    def remove_object(self, obj):
+        """Removes an object from the list of polled objects."""
+
+        try:
+            fd = obj.fileno()
+
+            if self.__objects.get(fd) is obj:
+                self.__set_interest(fd, False, False)
+                del self.__objects[fd]
+                del self.__interest[fd]
+                self.__polled_objects.pop(fd, None)
+        except Exception as e:
+            LOG.error("Failed to remove %s from the I/O loop: %s.", obj, e)
+
+        self.__check_stop()
+
+
+    def set_interest(self, obj, read, write):
+        """Sets read/write interest of the object.
+
+        After the first call the object's poll_read()/poll_write() are not
+        called anymore - the object have to notify the I/O loop about every
+        interest change by itself.
+        """
+
+        fd = obj.fileno()
+
+        if self.__objects.get(fd) is not obj:
+            raise Error("{0} is not controlled by the I/O loop.", obj)
+
+        self.__polled_objects.pop(fd, None)
+        self.__set_interest(fd, read, write)
+
+
+
+    def time(self):
+        """Returns current time of the clock used for deferred calls."""
+
+        return self.__loop.time()
+
+
+    def call_at(self, call_time, func, *args, **kwargs):
+        """Schedule a deferred call.
+
+        call_time is measured in terms of the time() clock.
+        """
+
+        self.__ensure_not_closed()
+
+        call = _DeferCall(call_time, lambda: func(*args, **kwargs))
+        call.handle = self.__loop.call_at(call_time, self.__run_deferred_call, call)
+        self.__deferred_calls.add(call)
+
+        return call
+
+
+    def call_after(self, interval, func, *args, **kwargs):
+        """A shortcut for call_at()."""
+
+        return self.call_at(self.time() + interval, func, *args, **kwargs)
+
+
+    def call_next(self, func, *args, **kwargs):
+        """Schedules a call on the next loop iteration."""
+
+        self.__ensure_not_closed()
+
+        call = _DeferCall(0, lambda: func(*args, **kwargs))
+        call.handle = self.__loop.call_soon(self.__run_deferred_call, call)
+        self.__deferred_calls.add(call)
+
+        return call
+
+
+    def cancel_call(self, call):
+        """Cancels the specified deferred call."""
+
+        if call in self.__deferred_calls:
+            call.handle.cancel()
+            call.func = None
+            self.__deferred_calls.discard(call)
+            self.__check_stop()
+
+
+
+    def run_in_executor(self, func, callback):
+        """Runs a blocking function in a thread pool.
+
+        callback(result, error) is called in the I/O loop thread when the
+        function completes (error is None if the function hasn't raised an
+        exception).
+
+        The thread pool doesn't accept new tasks when the I/O loop is stopping
+        and abandons the pending ones.
+        """
+
+        self.__ensure_not_closed()
+
+        if self.__stopping:
+            raise Error("The I/O loop is stopping.")
+
+        if self.__executor is None:
+            self.__executor = _Executor(self.__loop, constants.EXECUTOR_THREADS)
+
+        executor = self.__executor
+
+        def on_completed(result, error):
+            # The task has been abandoned on the I/O loop stop
+            if executor is not self.__executor:
+                return
+
+            self.__executor_tasks -= 1
+
+            try:
+                callback(result, error)
+            except Exception:
+                LOG.exception("A thread pool task callback crashed.")
+
+            self.__schedule_update()
+            self.__check_stop()
+
+        self.__executor_tasks += 1
+        executor.submit(func, on_completed)
+
+
+
+    def start(self):
+        """Starts the I/O loop."""
+
+        self.__ensure_not_closed()
+
+        LOG.debug("Starting the I/O loop...")
+
+        if self.__objects or self.__deferred_calls or self.__executor_tasks:
+            self.__loop.run_forever()
+
+        LOG.debug("The I/O loop stopped.")
+
+
+    def stop(self):
+        """Stops the I/O loop."""
+
+        LOG.debug("Stopping the I/O loop...")
+
+        self.__stopping = True
+
+        for obj in list(self.__objects.values()):
+            try:
+                obj.stop()
+            except Exception:
+                LOG.exception("Failed to stop %s.", obj)
+
+        if self.__executor is not None:
+            if self.__executor_tasks:
+                LOG.warning("Abandoning %s pending thread pool tasks.", self.__executor_tasks)
+
+            self.__executor.shutdown()
+            self.__executor = None
+            self.__executor_tasks = 0
+
+        self.__check_stop()
+
+
+
+    def stopping(self):
+        """Returns True if the I/O loop is stopping."""
+
+        return self.__stopping
+
+
+    def get_stats(self):
+        """Returns the I/O loop statistics."""
+
+        return {
+            "callback_time":     dict(
+                (callback, histogram.to_dict())
+                for callback, histogram in self.__callback_time.items()),
+            "deferred_call_lag": self.__deferred_call_lag.to_dict(),
+        }
+
+
+
+    def __ensure_not_closed(self):
+        """Ensures that the I/O loop is not closed."""
+
+        if self.__closed:
+            raise Error("The I/O loop is closed.")
+
+
+    def __check_stop(self):
+        """Stops the asyncio event loop when there is nothing to do."""
+
+        if (
+            not self.__objects and not self.__deferred_calls and
+            not self.__executor_tasks and self.__loop.is_running()
+        ):
+            self.__loop.stop()
+
+
+    def __set_interest(self, fd, read, write):
+        """Sets read/write interest for the specified file descriptor."""
+
+        cur_read, cur_write = self.__interest[fd]
+
+        if read != cur_read:
+            if read:
+                self.__loop.add_reader(fd, self.__on_event, fd, "on_read")
+            else:
+                self.__loop.remove_reader(fd)
+
+        if write != cur_write:
+            if write:
+                self.__loop.add_writer(fd, self.__on_event, fd, "on_write")
+            else:
+                self.__loop.remove_writer(fd)
+
+        self.__interest[fd] = (read, write)
+
+
+    def __schedule_update(self):
+        """Schedules polled objects interest update."""
+
+        if self.__polled_objects and not self.__update_scheduled:
+            self.__update_scheduled = True
+            self.__loop.call_soon(self.__update_polled_objects)
+
+
+    def __update_polled_objects(self):
+        """
+        Updates interest for all objects that don't set their interest
+        explicitly.
+        """
+
+        self.__update_scheduled = False
+
+        for fd, obj in list(self.__polled_objects.items()):
+            try:
+                self.__set_interest(fd, bool(obj.poll_read()), bool(obj.poll_write()))
+            except Exception:
+                LOG.exception("Error while configuring polling for %s.", obj)
+
+
+    def __on_event(self, fd, callback):
+        """Called by the asyncio event loop when a file is ready for I/O."""
+
+        obj = self.__objects.get(fd)
+
+        if obj is not None and not obj.closed():
+            try:
+                self.__run_callback(obj, callback)
+
+                # Handle hang up after reading to not lose the data that has
+                # been sent by the peer before it
+                if callback == "on_read" and not obj.closed():
+                    events = _poll_errors(fd)
+
+                    if events & select.POLLERR:
+                        self.__run_callback(obj, "on_error", Error("Disconnected."))
+
+                    if events & select.POLLHUP and not obj.closed():
+                        self.__run_callback(obj, "on_hang_up")
+            except Exception as e:
+                if not isinstance(e, (EnvironmentError, EOFError)):
+                    LOG.exception("%s handling crashed.", obj)
+
+                self.__run_callback(obj, "on_error", e)
+
+        self.__schedule_update()
+
+
+    def __run_callback(self, obj, callback, *args):
+        """Runs the specified file object callback."""
+
+        start_time = self.__loop.time()
+
+        try:
+            getattr(obj, callback)(*args)
+        finally:
+            self.__callback_time[callback].add(self.__loop.time() - start_time)
+
+
+    def __run_deferred_call(self, call):
+        """Runs the specified deferred call."""
+
+        self.__deferred_calls.discard(call)
+
+        func = call.func
+        call.func = None
+
+        # Calls scheduled via call_next() have no meaningful time
+        if call.time:
+            self.__deferred_call_lag.add(max(0, self.time() - call.time))
+
+        try:
+            func()
+        except Exception:
+            LOG.exception("A deferred call crashed.")
+
+        self.__schedule_update()
+        self.__check_stop()
+
+
+
+class _DeferCall(object):
+    """Represents a deferred call object."""
+
+    __slots__ = ("time", "func", "handle")
+
+    def __init__(self, call_time, func):
+        self.time = call_time
+        self.func = func
+        self.handle = None
+
+
+
+class _Executor(object):
+    """
+    A bounded thread pool which delivers completions to the asyncio event loop.
+
+    Unlike concurrent.futures.ThreadPoolExecutor, the worker threads are
+    daemonic and aren't joined on the process exit, so a hung task can't delay
+    it.
+    """
+
+    def __init__(self, loop, max_workers):
+        # The asyncio event loop
+        self.__loop = loop
+
+        # Maximum number of worker threads
+        self.__max_workers = max_workers
+
+        # Number of worker threads
+        self.__workers = 0
+
+        # Number of submitted but not completed tasks
+        self.__pending = 0
+
+        # Task queue
+        self.__tasks = queue.Queue()
+
+        self.__shutdown = False
+
+
+    def shutdown(self):
+        """Shuts down the pool without waiting for the pending tasks."""
+
+        self.__shutdown = True
+
+        # Drop the tasks that haven't been started yet
+        while True:
+            try:
+                self.__tasks.get_nowait()
+            except queue.Empty:
+                break
+
+        for worker in range(self.__workers):
+            self.__tasks.put(None)
+
+        self.__workers = 0
+
+
+    def submit(self, func, callback):
+        """Submits a task.
+
+        callback(result, error) is called in the event loop thread.
+        """
+
+        self.__pending += 1
+        self.__tasks.put((func, callback))
+
+        if self.__workers < min(self.__pending, self.__max_workers):
+            worker = threading.Thread(target=self.__worker,
+                name="I/O loop thread pool worker")
+            worker.daemon = True
+            worker.start()
+            self.__workers += 1
+
+
+    def __worker(self):
+        """Worker thread's main function."""
+
+        while True:
+            task = self.__tasks.get()
+            if task is None:
+                break
+
+            func, callback = task
+            result = error = None
+
+            try:
+                result = func()
+            except Exception as e:
+                error = e
+
+            if self.__shutdown:
+                break
+
+            try:
+                self.__loop.call_soon_threadsafe(self.__on_completed, callback, result, error)
+            except RuntimeError:
+                # The event loop is closed
+                break
+
+
+    def __on_completed(self, callback, result, error):
+        """Called in the event loop thread when a task completes."""
+
+        self.__pending -= 1
+        callback(result, error)
+
+
+
+def _poll_errors(fd):
+    """Returns POLLERR/POLLHUP events that are pending for the file descriptor."""
+
+    poll = select.poll()
+    poll.register(fd, 0)
+
+    for poll_fd, events in poll.poll(0):
+        return events & (select.POLLERR | select.POLLHUP)
+
+    return 0
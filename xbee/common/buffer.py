@@ -0,0 +1,165 @@
+"""Provides a preallocated I/O buffer."""
+
+from __future__ import unicode_literals
+
+import os
+
+from pcore import PY3
+from psys import eintr_retry
+
+from xbee.common import constants
+from xbee.common.core import Error
+
+
+class BufferOverflowError(Error):
+    """Raised when a buffer reaches its maximum size."""
+
+    def __init__(self, max_size):
+        super(BufferOverflowError, self).__init__(
+            "Buffer overflow: its size has reached the limit of {0} bytes.", max_size)
+
+
+
+class Buffer(object):
+    """A preallocated I/O buffer.
+
+    Data is stored in a contiguous bytearray between the read and write
+    offsets: consuming data only moves the read offset, and the unconsumed
+    data is moved to the beginning of the storage only when there is no free
+    space at its end. This way the data can be parsed via memoryviews without
+    any copying.
+
+    Note: the views returned by view() are valid only until the next
+    modification of the buffer.
+
+    Python 2 memoryview items are strings, so on Python 2 view() returns a
+    bytearray copy of the data to keep byte access the same on both versions.
+    """
+
+    def __init__(self, size=constants.BUFSIZE, max_size=None):
+        # Maximum size of the buffered data
+        self.__max_size = max_size
+
+        # Data storage
+        self.__data = bytearray(size)
+
+        # Start and end of the buffered data
+        self.__start = self.__end = 0
+
+
+    def __len__(self):
+        return self.__end - self.__start
+
+
+    def __bool__(self):
+        return self.__end != self.__start
+
+    __nonzero__ = __bool__
+
+
+    def view(self, start=0, end=None):
+        """
+        Returns a memoryview of the buffered data (a bytearray copy on Python
+        2).
+        """
+
+        length = self.__end - self.__start
+        end = length if end is None else min(end, length)
+
+        if PY3:
+            return memoryview(self.__data)[self.__start + start:self.__start + end]
+        else:
+            return self.__data[self.__start + start:self.__start + end]
+
+
+    def find(self, sub, start=0):
+        """
+        Returns the lowest offset where the specified bytes are found or -1.
+        """
+
+        pos = self.__data.find(sub, self.__start + start, self.__end)
+        return pos if pos == -1 else pos - self.__start
+
+
+    def consume(self, size):
+        """Removes the specified number of bytes from the buffer start."""
+
+        self.__start = min(self.__start + size, self.__end)
+        if self.__start == self.__end:
+            self.__start = self.__end = 0
+
+
+    def clear(self):
+        """Clears the buffer."""
+
+        self.__start = self.__end = 0
+
+
+    def extend(self, data):
+        """Appends the specified data to the buffer."""
+
+        size = len(data)
+        self.__reserve(size)
+        self.__data[self.__end:self.__end + size] = data
+        self.__end += size
+
+
+    def read_from(self, fd, size):
+        """
+        Reads up to the specified number of bytes from the file descriptor
+        directly into the buffer.
+
+        Returns the number of bytes that have been read (0 on end of file).
+        """
+
+        size = self.__reserve(size)
+
+        if _readv is None:
+            data = eintr_retry(os.read)(fd, size)
+            size = len(data)
+            self.__data[self.__end:self.__end + size] = data
+        else:
+            size = eintr_retry(_readv)(fd,
+                [memoryview(self.__data)[self.__end:self.__end + size]])
+
+        self.__end += size
+        return size
+
+
+    def __reserve(self, size):
+        """
+        Reserves free space for the specified number of bytes at the end of the
+        buffer.
+
+        Returns the number of bytes that may be appended to the buffer (may be
+        less than requested if the buffer is limited in size, but always
+        greater than zero).
+        """
+
+        length = self.__end - self.__start
+
+        if self.__max_size is not None:
+            if length >= self.__max_size:
+                raise BufferOverflowError(self.__max_size)
+
+            size = min(size, self.__max_size - length)
+
+        if self.__end + size <= len(self.__data):
+            return size
+
+        if length + size <= len(self.__data):
+            # Move the data to the beginning of the storage
+            self.__data[:length] = self.__data[self.__start:self.__end]
+        else:
+            data = bytearray(max(2 * len(self.__data), length + size))
+            data[:length] = self.__data[self.__start:self.__end]
+            self.__data = data
+
+        self.__start, self.__end = 0, length
+
+        return size
+
+
+
+_readv = getattr(os, "readv", None)
+"""os.readv() if it's available on the current platform."""
@@ -13,8 +13,26 @@ MEGABYTE = 1024 * KILOBYTE
 BUFSIZE = 4 * KILOBYTE
 """I/O buffer size."""
 
+MAX_READ_BUFFER_SIZE = MEGABYTE
+"""Default limit for file objects' read buffer size."""
+
 SERVER_SOCKET_PATH = "/var/run/xbee-monitor"
 """Path to the server socket."""
 
+STATS_SNAPSHOT_PATH = "/var/run/xbee-monitor.stats"
+"""Path to the memory-mapped snapshot of the last metric values."""
+
+STATS_SNAPSHOT_CAPACITY = 1024
+"""Maximum number of metrics in the stats snapshot."""
+
 IPC_TIMEOUT = 10
 """Timeout for IPC requests."""
+
+EXECUTOR_THREADS = 4
+"""Maximum number of threads in the I/O loop's thread pool."""
+
+FRAME_RECORDER_CAPACITY = 1000
+"""Number of last raw frames recorded for each sensor."""
+
+METRIC_HISTORY_SIZE = 1000
+"""Number of last values recorded for each metric."""
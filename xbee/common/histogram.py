@@ -0,0 +1,68 @@
+"""Provides cheap fixed-bucket histograms."""
+
+from __future__ import unicode_literals
+
+import bisect
+
+
+TIME_BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.0005,
+    0.001,   0.005,   0.01,   0.05,
+    0.1,     0.5,     1,      5,
+)
+"""Bucket upper bounds for time measurements (in seconds)."""
+
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+"""Bucket upper bounds for small counters."""
+
+
+class Histogram(object):
+    """A histogram with fixed bucket bounds.
+
+    Values greater than the last bound are counted in an additional overflow
+    bucket.
+    """
+
+    __slots__ = ("__bounds", "__counts", "__count", "__sum", "__max")
+
+    def __init__(self, bounds):
+        # Bucket upper bounds
+        self.__bounds = bounds
+
+        # Bucket counters
+        self.__counts = [0] * (len(bounds) + 1)
+
+        self.__count = 0
+        self.__sum = 0
+        self.__max = None
+
+
+    def add(self, value):
+        """Adds a value to the histogram."""
+
+        self.__counts[bisect.bisect_left(self.__bounds, value)] += 1
+        self.__count += 1
+        self.__sum += value
+
+        if self.__max is None or value > self.__max:
+            self.__max = value
+
+
+    def to_dict(self):
+        """Returns the histogram in a JSON-serializable form."""
+
+        buckets = [
+            [bound, count]
+            for bound, count in zip(self.__bounds, self.__counts) if count
+        ]
+
+        if self.__counts[-1]:
+            buckets.append([None, self.__counts[-1]])
+
+        return {
+            "count":   self.__count,
+            "sum":     self.__sum,
+            "avg":     float(self.__sum) / self.__count if self.__count else None,
+            "max":     self.__max,
+            "buckets": buckets,
+        }
@@ -0,0 +1,156 @@
+"""Provides an inotify file object."""
+
+from __future__ import unicode_literals
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+
+from xbee.common.core import Error
+from xbee.common.io_loop import FileObject
+
+LOG = logging.getLogger(__name__)
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+
+_EVENT_HEADER = struct.Struct(b"iIII")
+"""inotify_event structure header: wd, mask, cookie, len."""
+
+
+class Inotify(FileObject):
+    """An inotify instance.
+
+    Subclasses should override on_event() to handle the events.
+    """
+
+    edge_triggered = True
+
+    def __init__(self, io_loop, name):
+        libc = _libc()
+
+        fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            raise Error("Unable to create an inotify instance: {0}.",
+                os.strerror(ctypes.get_errno()))
+
+        try:
+            super(Inotify, self).__init__(io_loop, os.fdopen(fd, "rb", 0), name)
+        except:
+            os.close(fd)
+            raise
+
+        try:
+            self._set_interest(read=True)
+        except:
+            self.close()
+            raise
+
+
+    def add_watch(self, path, mask):
+        """Adds a watch for the specified path. Returns a watch descriptor."""
+
+        if not isinstance(path, bytes):
+            path = path.encode("utf-8")
+
+        wd = _libc().inotify_add_watch(self.fileno(), path, mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise EnvironmentError(error, os.strerror(error))
+
+        return wd
+
+
+    def remove_watch(self, wd):
+        """Removes the specified watch."""
+
+        if _libc().inotify_rm_watch(self.fileno(), wd) < 0:
+            error = ctypes.get_errno()
+            if error != errno.EINVAL:
+                LOG.error("Failed to remove an inotify watch: %s.", os.strerror(error))
+
+
+    def on_read(self):
+        """Called when we have data to read."""
+
+        eof = self._read_available()
+        buf = self._read_buffer.view()
+        offset = 0
+
+        try:
+            while len(buf) - offset >= _EVENT_HEADER.size:
+                wd, mask, cookie, size = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+
+                if len(buf) - offset < size:
+                    offset -= _EVENT_HEADER.size
+                    break
+
+                name = bytes(buf[offset:offset + size]).rstrip(b"\0")
+                offset += size
+
+                self.on_event(wd, mask, name.decode("utf-8", "replace"))
+
+                if self.closed():
+                    return
+        finally:
+            if not self.closed():
+                self._read_buffer.consume(offset)
+
+        if eof:
+            raise EOFError("End of file has been reached.")
+
+
+    def on_event(self, wd, mask, name):
+        """Called on inotify event."""
+
+        raise Error("Not implemented.")
+
+
+    def stop(self):
+        """Called when the I/O loop ends its work."""
+
+        self.close()
+
+
+
+_LIBC = None
+"""Loaded C library."""
+
+
+def _libc():
+    """Returns the C library with inotify functions."""
+
+    global _LIBC
+
+    if _LIBC is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+            libc.inotify_init1.argtypes = (ctypes.c_int,)
+            libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+            libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        except (EnvironmentError, AttributeError) as e:
+            raise Error("inotify is not available: {0}.", e)
+
+        _LIBC = libc
+
+    return _LIBC
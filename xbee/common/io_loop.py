@@ -2,39 +2,124 @@
 
 from __future__ import unicode_literals
 
-import bisect
 import errno
+import fcntl
+import heapq
 import logging
 import os
 import select
+import threading
 import time
 import weakref
 
-from collections import namedtuple
-from select import EPOLLIN, EPOLLOUT, EPOLLHUP, EPOLLERR
+from collections import deque, OrderedDict
+from itertools import islice
+from select import EPOLLIN, EPOLLOUT, EPOLLHUP, EPOLLERR, EPOLLET
 
-from pcore import PY3, range
+from pcore import PY3
 from psys import eintr_retry
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from xbee.common import constants
+from xbee.common.buffer import Buffer
 from xbee.common.core import Error
+from xbee.common.histogram import Histogram, COUNT_BUCKETS, TIME_BUCKETS
 
 LOG = logging.getLogger(__name__)
 
 
+PRIORITY_HIGH = 0
+"""High I/O priority (device input)."""
+
+PRIORITY_NORMAL = 1
+"""Normal I/O priority."""
+
+PRIORITY_LOW = 2
+"""Low I/O priority (client connections)."""
+
+_DEFERRED_CALLS_PRIORITY = PRIORITY_NORMAL
+"""
+Priority of deferred calls: they are processed after high priority events but
+before normal priority events.
+"""
+
+
+# Use a monotonic clock for deferred calls if the platform supports it
+try:
+    monotonic_time = time.monotonic
+except AttributeError:
+    monotonic_time = time.time
+
+
 class IoLoop(object):
-    """Main loop for handling I/O operations."""
+    """Main loop for handling I/O operations.
+
+    If edge_triggered is True, objects that support it are polled in
+    edge-triggered mode (see FileObject.edge_triggered).
+
+    Events and deferred calls are processed in priority order (see
+    FileObject.priority). If budget is specified, each loop iteration
+    processes events and deferred calls until the budget (in seconds) is
+    exhausted - the rest is carried over to the next iteration.
+    """
+
+    def __init__(self, edge_triggered=False, budget=None):
+        # Use edge-triggered mode for objects that support it
+        self.__edge_triggered = edge_triggered
+
+        # Time budget for one loop iteration
+        self.__budget = budget
+
+        # Queues of pending events for each priority: fd -> epoll flags
+        self.__event_queues = [
+            OrderedDict() for priority in range(PRIORITY_LOW + 1)]
 
-    def __init__(self):
         # Polled objects
         self.__objects = {}
 
+        # Objects that don't set their interest explicitly and have to be
+        # asked about it via poll_read()/poll_write() on each iteration
+        self.__polled_objects = {}
+
         # epoll flags cache
         self.__epoll_flags = {}
 
-        # A list of scheduled deferred calls
+        # A heap of scheduled deferred calls
         self.__deferred_calls = []
 
+        # Number of cancelled calls that are still in the heap
+        self.__cancelled_calls = 0
+
+        # Deferred call counter which keeps the calls with equal time in FIFO
+        # order
+        self.__call_counter = 0
+
+        # Loop instrumentation: loop iteration time (without time spent in
+        # waiting for events), number of events returned by one epoll call,
+        # time spent in each file object callback and deferred call lag
+        self.__iteration_time = Histogram(TIME_BUCKETS)
+        self.__poll_events = Histogram(COUNT_BUCKETS)
+        self.__callback_time = dict(
+            (callback, Histogram(TIME_BUCKETS))
+            for callback in ("on_read", "on_write", "on_error", "on_hang_up"))
+        self.__deferred_call_lag = Histogram(TIME_BUCKETS)
+
+        # Scheduler counters: number of iterations on which the budget has
+        # been exhausted while processing events/deferred calls and total
+        # number of events that have been carried over to the next iteration
+        self.__events_budget_exhausted = 0
+        self.__calls_budget_exhausted = 0
+        self.__carried_over_events = 0
+
+        # Thread pool for blocking operations (created on demand)
+        self.__executor = None
+
         self.__epoll = select.epoll()
+        self.__stopping = False
         self.__closed = False
 
 
@@ -60,7 +145,10 @@ class IoLoop(object):
             obj.close()
 
         # Break possible cycle references
+        for call_time, call_id, call in self.__deferred_calls:
+            call.func = None
         del self.__deferred_calls[:]
+        self.__cancelled_calls = 0
 
         try:
             eintr_retry(self.__epoll.close)()
@@ -80,6 +168,7 @@ class IoLoop(object):
             raise Error("Unable to register a file descriptor in epoll: {0}.", e)
 
         self.__objects[obj.fileno()] = obj
+        self.__polled_objects[obj.fileno()] = obj
 
 
     def remove_object(self, obj):
@@ -91,6 +180,8 @@ class IoLoop(object):
             if fileno in self.__objects:
                 self.__epoll.unregister(fileno)
                 del self.__objects[fileno]
+                self.__polled_objects.pop(fileno, None)
+                self.__event_queues[obj.priority].pop(fileno, None)
 
                 try:
                     del self.__epoll_flags[fileno]
@@ -100,16 +191,50 @@ class IoLoop(object):
             LOG.error("Failed to remove %s from the I/O loop: %s.", e)
 
 
+    def set_interest(self, obj, read, write):
+        """Sets read/write interest of the object.
+
+        After the first call the object's poll_read()/poll_write() are not
+        called anymore - the object have to notify the I/O loop about every
+        interest change by itself.
+        """
+
+        fd = obj.fileno()
+
+        if self.__objects.get(fd) is not obj:
+            raise Error("{0} is not controlled by the I/O loop.", obj)
+
+        self.__polled_objects.pop(fd, None)
+
+        flags = 0
+        if read:
+            flags |= EPOLLIN
+        if write:
+            flags |= EPOLLOUT
+
+        self.__set_epoll_flags(obj, fd, flags)
+
+
+
+    def time(self):
+        """Returns current time of the clock used for deferred calls."""
+
+        return monotonic_time()
+
 
     def call_at(self, call_time, func, *args, **kwargs):
-        """Schedule a deferred call."""
+        """Schedule a deferred call.
+
+        call_time is measured in terms of the time() clock.
+        """
 
         self.__ensure_not_closed()
 
         call = _DeferCall(call_time, lambda: func(*args, **kwargs))
 
-        self.__deferred_calls.insert(
-            bisect.bisect(self.__deferred_calls, call), call)
+        heapq.heappush(self.__deferred_calls,
+            (call_time, self.__call_counter, call))
+        self.__call_counter += 1
 
         return call
 
@@ -117,7 +242,7 @@ class IoLoop(object):
     def call_after(self, interval, func, *args, **kwargs):
         """A shortcut for call_at()."""
 
-        return self.call_at(time.time() + interval, func, *args, **kwargs)
+        return self.call_at(self.time() + interval, func, *args, **kwargs)
 
 
     def call_next(self, func, *args, **kwargs):
@@ -129,10 +254,46 @@ class IoLoop(object):
     def cancel_call(self, call):
         """Cancels the specified deferred call."""
 
-        for call_id in range(len(self.__deferred_calls)):
-            if self.__deferred_calls[call_id] is call:
-                del self.__deferred_calls[call_id]
-                return
+        if call.cancelled:
+            return
+
+        call.cancelled = True
+        call.func = None
+
+        if call.pending:
+            self.__cancelled_calls += 1
+
+            # Cancelled calls are removed lazily, but don't allow them to bloat
+            # the heap.
+            if self.__cancelled_calls > max(64, len(self.__deferred_calls) // 2):
+                self.__deferred_calls[:] = [
+                    entry for entry in self.__deferred_calls
+                        if not entry[2].cancelled]
+                heapq.heapify(self.__deferred_calls)
+                self.__cancelled_calls = 0
+
+
+
+    def run_in_executor(self, func, callback):
+        """Runs a blocking function in a thread pool.
+
+        callback(result, error) is called in the I/O loop thread when the
+        function completes (error is None if the function hasn't raised an
+        exception).
+
+        The thread pool doesn't accept new tasks when the I/O loop is stopping
+        and abandons the pending ones (see _Executor.stop()).
+        """
+
+        self.__ensure_not_closed()
+
+        if self.__stopping:
+            raise Error("The I/O loop is stopping.")
+
+        if self.__executor is None or self.__executor.closed():
+            self.__executor = _Executor(self, constants.EXECUTOR_THREADS)
+
+        self.__executor.submit(func, callback)
 
 
 
@@ -143,10 +304,20 @@ class IoLoop(object):
 
         LOG.debug("Starting the I/O loop...")
 
-        while self.__objects or self.__deferred_calls:
+        while self.__objects or self.__pending_calls():
+            iteration_start_time = monotonic_time()
+
             self.__update_epoll_flags()
-            self.__poll_objects()
-            self.__process_deferred_calls()
+            wait_time = self.__poll_objects()
+
+            deadline = None
+            if self.__budget is not None:
+                deadline = iteration_start_time + wait_time + self.__budget
+
+            self.__process_events(deadline)
+
+            self.__iteration_time.add(
+                monotonic_time() - iteration_start_time - wait_time)
 
         LOG.debug("The I/O loop stopped.")
 
@@ -156,6 +327,8 @@ class IoLoop(object):
 
         LOG.debug("Stopping the I/O loop...")
 
+        self.__stopping = True
+
         for obj in list(self.__objects.values()):
             try:
                 obj.stop()
@@ -164,6 +337,31 @@ class IoLoop(object):
 
 
 
+    def stopping(self):
+        """Returns True if the I/O loop is stopping."""
+
+        return self.__stopping
+
+
+    def get_stats(self):
+        """Returns the I/O loop statistics."""
+
+        return {
+            "iteration_time":    self.__iteration_time.to_dict(),
+            "poll_events":       self.__poll_events.to_dict(),
+            "callback_time":     dict(
+                (callback, histogram.to_dict())
+                for callback, histogram in self.__callback_time.items()),
+            "deferred_call_lag": self.__deferred_call_lag.to_dict(),
+            "scheduler": {
+                "events_budget_exhausted": self.__events_budget_exhausted,
+                "calls_budget_exhausted":  self.__calls_budget_exhausted,
+                "carried_over_events":     self.__carried_over_events,
+            },
+        }
+
+
+
     def __ensure_not_closed(self):
         """Ensures that the I/O loop is not closed."""
 
@@ -171,10 +369,31 @@ class IoLoop(object):
             raise Error("The I/O loop is closed.")
 
 
+    def __pending_calls(self):
+        """Returns number of pending deferred calls."""
+
+        return len(self.__deferred_calls) - self.__cancelled_calls
+
+
+    def __next_call(self):
+        """Returns the nearest pending deferred call or None."""
+
+        deferred_calls = self.__deferred_calls
+
+        while deferred_calls and deferred_calls[0][2].cancelled:
+            heapq.heappop(deferred_calls)[2].pending = False
+            self.__cancelled_calls -= 1
+
+        return deferred_calls[0][2] if deferred_calls else None
+
+
     def __update_epoll_flags(self):
-        """Updates epoll flags for all polled objects."""
+        """
+        Updates epoll flags for all objects that don't set their interest
+        explicitly.
+        """
 
-        for fd, obj in self.__objects.items():
+        for fd, obj in self.__polled_objects.items():
             try:
                 obj_flags = 0
 
@@ -184,79 +403,203 @@ class IoLoop(object):
                 if obj.poll_write():
                     obj_flags |= EPOLLOUT
 
-                if self.__epoll_flags.get(fd, 0) != obj_flags:
-                    self.__epoll.modify(fd, obj_flags)
-                    self.__epoll_flags[fd] = obj_flags
+                self.__set_epoll_flags(obj, fd, obj_flags)
             except Exception:
                 LOG.exception("Error while configuring epoll for %s.", obj)
 
 
+    def __set_epoll_flags(self, obj, fd, flags):
+        """Sets epoll flags for the specified object."""
+
+        if flags and self.__edge_triggered and obj.edge_triggered:
+            flags |= EPOLLET
+
+        if self.__epoll_flags.get(fd, 0) != flags:
+            self.__epoll.modify(fd, flags)
+            self.__epoll_flags[fd] = flags
+
+
     def __poll_objects(self):
-        """Polls the controlled objects."""
+        """
+        Polls the controlled objects and queues the events. Returns time spent
+        in waiting for events.
+        """
+
+        if any(self.__event_queues):
+            # There are events carried over from the previous iteration
+            timeout = 0
+        else:
+            timeout = -1
+            call = self.__next_call()
+            if call is not None:
+                timeout = max(0, call.time - self.time())
 
-        timeout = -1
-        if self.__deferred_calls:
-            timeout = max(0, self.__deferred_calls[0].time - time.time())
+        wait_start_time = monotonic_time()
+        events = eintr_retry(self.__epoll.poll)(timeout=timeout)
+        wait_time = monotonic_time() - wait_start_time
 
-        for fd, flags in eintr_retry(self.__epoll.poll)(timeout=timeout):
+        self.__poll_events.add(len(events))
+
+        for fd, flags in events:
             try:
                 obj = self.__objects[fd]
             except KeyError:
                 continue
 
-            try:
-                if flags & EPOLLERR:
-                    if not obj.closed():
-                        obj.on_error(Error("Disconnected."))
+            queue = self.__event_queues[obj.priority]
+            queue[fd] = queue.get(fd, 0) | flags
 
-                if flags & EPOLLHUP:
-                    if not obj.closed():
-                        obj.on_hang_up()
+        return wait_time
 
-                if flags & EPOLLIN:
-                    if not obj.closed():
-                        obj.on_read()
 
-                if flags & EPOLLOUT:
-                    if not obj.closed():
-                        obj.on_write()
-            except Exception as e:
-                if not isinstance(e, (EnvironmentError, EOFError)):
-                    LOG.exception("%s handling crashed.", obj)
+    def __process_events(self, deadline):
+        """
+        Processes the queued events and the deferred calls in priority order
+        until the specified deadline.
+
+        To not starve lower priorities, at least one event of each priority
+        (and one deferred call) is processed on each iteration.
+        """
 
-                obj.on_error(e)
+        events_budget_exhausted = False
 
+        for priority, event_queue in enumerate(self.__event_queues):
+            if priority == _DEFERRED_CALLS_PRIORITY:
+                if not self.__process_deferred_calls(deadline):
+                    self.__calls_budget_exhausted += 1
 
-    def __process_deferred_calls(self):
-        """Processes pending deferred calls."""
+            processed = False
 
-        if not self.__deferred_calls:
+            while event_queue:
+                if processed and deadline is not None and monotonic_time() >= deadline:
+                    events_budget_exhausted = True
+                    break
+
+                fd, flags = event_queue.popitem(last=False)
+                self.__handle_events(fd, flags)
+                processed = True
+
+        if events_budget_exhausted:
+            self.__events_budget_exhausted += 1
+            self.__carried_over_events += sum(
+                len(event_queue) for event_queue in self.__event_queues)
+
+
+    def __handle_events(self, fd, flags):
+        """Handles epoll events for the specified file descriptor."""
+
+        try:
+            obj = self.__objects[fd]
+        except KeyError:
             return
 
-        cur_time = time.time()
-        precision = 0.001
+        # Events may be carried over from previous iterations, so drop the
+        # ones the object isn't interested in anymore
+        flags &= self.__epoll_flags.get(fd, 0) | EPOLLERR | EPOLLHUP
+
+        try:
+            if flags & EPOLLERR:
+                if not obj.closed():
+                    self.__run_callback(obj, "on_error", Error("Disconnected."))
+
+            if flags & EPOLLIN:
+                if not obj.closed():
+                    self.__run_callback(obj, "on_read")
+
+            if flags & EPOLLOUT:
+                if not obj.closed():
+                    self.__run_callback(obj, "on_write")
+
+            # Handle hang up after reading to not lose the data that has
+            # been sent by the peer before it
+            if flags & EPOLLHUP:
+                if not obj.closed():
+                    self.__run_callback(obj, "on_hang_up")
+        except Exception as e:
+            if not isinstance(e, (EnvironmentError, EOFError)):
+                LOG.exception("%s handling crashed.", obj)
+
+            self.__run_callback(obj, "on_error", e)
+
+
+    def __run_callback(self, obj, callback, *args):
+        """Runs the specified file object callback."""
+
+        start_time = monotonic_time()
 
-        for call_id in range(len(self.__deferred_calls)):
-            if self.__deferred_calls[call_id].time - precision > cur_time:
-                pending_calls = self.__deferred_calls[:call_id]
-                del self.__deferred_calls[:call_id]
+        try:
+            getattr(obj, callback)(*args)
+        finally:
+            self.__callback_time[callback].add(monotonic_time() - start_time)
+
+
+    def __process_deferred_calls(self, deadline):
+        """
+        Processes pending deferred calls until the specified deadline. Returns
+        False if the deadline has been reached.
+        """
+
+        if not self.__pending_calls():
+            return True
+
+        deferred_calls = self.__deferred_calls
+        due_time = self.time() + 0.001
+        processed = False
+
+        # Calls scheduled by the processed calls will be processed on the next
+        # iteration
+        last_call_id = self.__call_counter
+
+        while deferred_calls:
+            call_time, call_id, call = deferred_calls[0]
+
+            if call.cancelled:
+                heapq.heappop(deferred_calls)
+                call.pending = False
+                self.__cancelled_calls -= 1
+                continue
+
+            if call_time > due_time or call_id >= last_call_id:
                 break
-        else:
-            pending_calls = self.__deferred_calls
-            self.__deferred_calls = []
 
-        for call in pending_calls:
+            if processed and deadline is not None and monotonic_time() >= deadline:
+                return False
+
+            heapq.heappop(deferred_calls)
+            call.pending = False
+
+            func = call.func
+            call.func = None
+
+            # Calls scheduled via call_next() have no meaningful time
+            if call_time:
+                self.__deferred_call_lag.add(max(0, self.time() - call_time))
+
             try:
-                call.func()
+                func()
             except Exception:
                 LOG.exception("A deferred call crashed.")
 
+            processed = True
+
+        return True
+
 
 
 class FileObject(object):
     """Represents a file object to connect to I/O loop."""
 
-    def __init__(self, io_loop, file_obj, name):
+    edge_triggered = False
+    """
+    True if the object reads/writes/accepts until EAGAIN on each event and thus
+    may be polled in edge-triggered mode.
+    """
+
+    priority = PRIORITY_NORMAL
+    """I/O priority of the object."""
+
+    def __init__(self, io_loop, file_obj, name,
+        max_read_buffer_size=constants.MAX_READ_BUFFER_SIZE):
         # I/O loop that controls the object
         self._weak_io_loop = weakref.ref(io_loop)
 
@@ -267,14 +610,18 @@ class FileObject(object):
         self.__name = name
 
         # The object's read buffer
-        self._read_buffer = bytearray()
+        self._read_buffer = Buffer(max_size=max_read_buffer_size)
 
-        # The object's write buffer
-        self._write_buffer = bytearray()
+        # The object's write queue - a list of data segments
+        self._write_buffer = deque()
 
         # A list of handlers that will be called on object close
         self.__on_close_handlers = []
 
+        # Current read/write interest (if set explicitly)
+        self.__read_interest = False
+        self.__write_interest = False
+
         io_loop.add_object(self)
 
 
@@ -319,13 +666,21 @@ class FileObject(object):
 
 
     def poll_read(self):
-        """Returns True if we need to poll the file for read availability."""
+        """Returns True if we need to poll the file for read availability.
+
+        Is called on each I/O loop iteration until the object sets its interest
+        explicitly via _set_interest().
+        """
 
         return False
 
 
     def poll_write(self):
-        """Returns True if we need to poll the file for write availability."""
+        """Returns True if we need to poll the file for write availability.
+
+        Is called on each I/O loop iteration until the object sets its interest
+        explicitly via _set_interest().
+        """
 
         return False
 
@@ -387,55 +742,101 @@ class FileObject(object):
 
 
 
+    def _set_interest(self, read=None, write=None):
+        """
+        Sets read/write interest of the object (None leaves the current value
+        unchanged).
+        """
+
+        if read is not None:
+            self.__read_interest = read
+
+        if write is not None:
+            self.__write_interest = write
+
+        if self.closed():
+            return
+
+        io_loop = self._weak_io_loop()
+        if io_loop is not None:
+            io_loop.set_interest(self, self.__read_interest, self.__write_interest)
+
+
     def _clear_read_buffer(self):
         """Clears the read buffer."""
 
-        del self._read_buffer[:]
+        self._read_buffer.clear()
 
 
-    def _read(self, size):
+    def _read_available(self, empty_read_is_eof=True):
         """
-        Reads data from the file to the read buffer and returns True only when
-        the specified size will be read.
+        Reads all data that is currently available in the file to the read
+        buffer.
+
+        Returns True if end of file has been reached - in this case the caller
+        should process the data that has been read and handle the end of file.
+
+        Some files (for example TTYs in non-canonical mode with VMIN = 0)
+        return no data instead of EAGAIN when there is nothing to read. For
+        such files empty_read_is_eof should be False.
         """
 
-        if len(self._read_buffer) < size:
+        fileno = self.fileno()
+
+        while True:
             try:
-                data = eintr_retry(os.read)(self.fileno(), size - len(self._read_buffer))
+                size = self._read_buffer.read_from(fileno, _READ_CHUNK_SIZE)
             except EnvironmentError as e:
-                if e.errno != errno.EWOULDBLOCK:
-                    raise
-            else:
-                if not data:
-                    raise EOFError("End of file has been reached.")
-
-                self._read_buffer.extend(data)
+                if e.errno == errno.EWOULDBLOCK:
+                    return False
+                raise
 
-        return len(self._read_buffer) >= size
+            if not size:
+                return empty_read_is_eof
 
 
-    def _write(self, data=None):
+    def _write(self, *data):
         """
-        Writes the data from the write buffer + the specified data and returns
-        True only when all the data will be written.
+        Writes the data from the write queue + the specified data segments and
+        returns True only when all the data will be written.
+
+        The segments are queued without copying, so they mustn't be modified
+        until they are written.
         """
 
-        if data is not None:
-            self._write_buffer.extend(data)
+        write_buffer = self._write_buffer
 
-        if self._write_buffer:
+        for segment in data:
+            if segment:
+                write_buffer.append(memoryview(segment))
+
+        while write_buffer:
             try:
-                size = eintr_retry(os.write)(self.fileno(), self._write_buffer)
+                if _writev is None:
+                    size = eintr_retry(os.write)(self.fileno(), write_buffer[0])
+                else:
+                    size = eintr_retry(_writev)(self.fileno(),
+                        list(islice(write_buffer, _IOV_MAX)))
             except EnvironmentError as e:
                 if e.errno == errno.EWOULDBLOCK:
-                    pass
+                    break
                 else:
                     raise
-            else:
-                if size:
-                    del self._write_buffer[:size + 1]
 
-        return not self._write_buffer
+            if not size:
+                break
+
+            while size:
+                segment = write_buffer[0]
+
+                if size < len(segment):
+                    write_buffer[0] = segment[size:]
+                    break
+
+                write_buffer.popleft()
+                size -= len(segment)
+
+        return not write_buffer
 
 
 
@@ -448,5 +849,187 @@ class FileObject(object):
 
 
 
-_DeferCall = namedtuple("DeferCall", ("time", "func"))
-"""Represents a deferred call object."""
+_READ_CHUNK_SIZE = 16 * constants.BUFSIZE
+"""Maximum size of data that is read by one system call."""
+
+_writev = getattr(os, "writev", None)
+"""os.writev() if it's available on the current platform."""
+
+# Maximum number of segments that may be written by one system call
+try:
+    _IOV_MAX = os.sysconf(str("SC_IOV_MAX"))
+except (ValueError, EnvironmentError):
+    _IOV_MAX = -1
+
+if _IOV_MAX <= 0:
+    _IOV_MAX = 16
+
+
+class _DeferCall(object):
+    """Represents a deferred call object."""
+
+    __slots__ = ("time", "func", "pending", "cancelled")
+
+    def __init__(self, call_time, func):
+        self.time = call_time
+        self.func = func
+        self.pending = True
+        self.cancelled = False
+
+
+
+class _Executor(FileObject):
+    """
+    A bounded thread pool which delivers completions to the I/O loop through a
+    pipe.
+
+    Closes itself when there are no pending tasks. The worker threads are
+    daemonic and the pool doesn't wait for the pending tasks on the I/O loop
+    stop, so a hung task can't delay the process exit.
+    """
+
+    edge_triggered = True
+
+    def __init__(self, io_loop, max_workers):
+        # Maximum number of worker threads
+        self.__max_workers = max_workers
+
+        # Worker threads
+        self.__workers = []
+
+        # Number of submitted but not completed tasks
+        self.__pending = 0
+
+        # Task queue
+        self.__tasks = queue.Queue()
+
+        # Completed tasks that have to be handled by the I/O loop and a lock
+        # which protects them and the write end of the pipe
+        self.__lock = threading.Lock()
+        self.__completions = []
+
+        read_fd, self.__write_fd = os.pipe()
+
+        try:
+            for fd in (read_fd, self.__write_fd):
+                fcntl.fcntl(fd, fcntl.F_SETFL,
+                    fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+            super(_Executor, self).__init__(
+                io_loop, os.fdopen(read_fd, "rb", 0), "Thread pool")
+        except:
+            eintr_retry(os.close)(read_fd)
+            eintr_retry(os.close)(self.__write_fd)
+            raise
+
+        try:
+            self._set_interest(read=True)
+        except:
+            self.close()
+            raise
+
+
+    def close(self):
+        """Closes the object."""
+
+        with self.__lock:
+            if self.__write_fd is not None:
+                try:
+                    eintr_retry(os.close)(self.__write_fd)
+                except Exception as e:
+                    LOG.error("Failed to close %s: %s.", self, e)
+
+                self.__write_fd = None
+
+        # Drop the tasks that haven't been started yet
+        while True:
+            try:
+                self.__tasks.get_nowait()
+            except queue.Empty:
+                break
+
+        for worker in self.__workers:
+            self.__tasks.put(None)
+
+        del self.__workers[:]
+        del self.__completions[:]
+
+        super(_Executor, self).close()
+
+
+    def submit(self, func, callback):
+        """Submits a task."""
+
+        self.__pending += 1
+        self.__tasks.put((func, callback))
+
+        if len(self.__workers) < min(self.__pending, self.__max_workers):
+            worker = threading.Thread(target=self.__worker,
+                name="I/O loop thread pool worker")
+            worker.daemon = True
+            worker.start()
+            self.__workers.append(worker)
+
+
+    def on_read(self):
+        """Called when we have data to read."""
+
+        eof = self._read_available()
+        self._clear_read_buffer()
+
+        with self.__lock:
+            completions = self.__completions
+            self.__completions = []
+
+        for callback, result, error in completions:
+            self.__pending -= 1
+
+            try:
+                callback(result, error)
+            except Exception:
+                LOG.exception("A thread pool task callback crashed.")
+
+        if eof:
+            raise EOFError("End of file has been reached.")
+
+        if not self.__pending:
+            self.close()
+
+
+    def stop(self):
+        """Called when the I/O loop ends its work."""
+
+        if self.__pending:
+            LOG.warning("Abandoning %s pending thread pool tasks.", self.__pending)
+
+        self.close()
+
+
+    def __worker(self):
+        """Worker thread's main function."""
+
+        while True:
+            task = self.__tasks.get()
+            if task is None:
+                break
+
+            func, callback = task
+            result = error = None
+
+            try:
+                result = func()
+            except Exception as e:
+                error = e
+
+            with self.__lock:
+                if self.__write_fd is None:
+                    break
+
+                self.__completions.append((callback, result, error))
+
+                if len(self.__completions) == 1:
+                    try:
+                        eintr_retry(os.write)(self.__write_fd, b"\0")
+                    except EnvironmentError as e:
+                        if e.errno != errno.EWOULDBLOCK:
+                            LOG.error("Failed to notify the I/O loop about a task completion: %s.", e)
@@ -0,0 +1,323 @@
+"""Provides a memory-mapped file of the last metric values.
+
+The file is shared with readers (see read_snapshot()) via a seqlock: the
+writer makes the sequence number odd before each modification and even after
+it, so a reader retries if the sequence number is odd or has changed while the
+data was being copied.
+"""
+
+from __future__ import unicode_literals
+
+import errno
+import logging
+import mmap
+import os
+import struct
+import time
+
+from psys import eintr_retry
+
+from xbee.common.core import Error
+
+LOG = logging.getLogger(__name__)
+
+
+_MAGIC = b"XBMS"
+"""Snapshot file magic."""
+
+_VERSION = 2
+"""Snapshot file format version."""
+
+_HEADER = struct.Struct(b"=4sHHIIQd")
+"""
+File header: magic, version, record size, capacity, monitor's PID, sequence
+number, monitor's start time.
+"""
+
+_LAYOUT = struct.Struct(b"=4sHHI")
+"""Layout part of the file header."""
+
+_MONITOR = struct.Struct(b"=I")
+"""Monitor's PID part of the file header."""
+
+_MONITOR_OFFSET = _LAYOUT.size
+"""Offset of the monitor's PID in the file header."""
+
+_SEQUENCE = struct.Struct(b"=Q")
+"""Sequence number part of the file header."""
+
+_SEQUENCE_OFFSET = _MONITOR_OFFSET + _MONITOR.size
+"""Offset of the sequence number in the file header."""
+
+_START_TIME = struct.Struct(b"=d")
+"""Monitor's start time part of the file header."""
+
+_START_TIME_OFFSET = _SEQUENCE_OFFSET + _SEQUENCE.size
+"""Offset of the monitor's start time in the file header."""
+
+_RECORD = struct.Struct(b"=B32s32sdd")
+"""Record: value type, host, metric name, time, value."""
+
+_TYPE_FREE = 0
+"""A free record."""
+
+_TYPE_INT = 1
+"""A record with an integer value."""
+
+_TYPE_FLOAT = 2
+"""A record with a float value."""
+
+_READ_ATTEMPTS = 100
+"""Maximum number of attempts to read a consistent snapshot."""
+
+MAX_NAME_SIZE = 32
+"""Maximum size of UTF-8 encoded host and metric names."""
+
+
+class Snapshot(object):
+    """A memory-mapped file of the last metric values.
+
+    The file consists of a header and a fixed number of fixed-size records -
+    one per (host, metric) pair, so an update is an in-place write of one
+    record and loading the file is only mapping and scanning it. A file with
+    an incompatible layout is reinitialized.
+
+    All modifications are made under the seqlock.
+    """
+
+    def __init__(self, path, capacity):
+        # (host, metric name) -> record index mappings
+        self.__records = {}
+
+        # Indexes of free records
+        self.__free = []
+
+        # Metrics that can't be saved to the snapshot
+        self.__skipped = set()
+
+        # The seqlock's sequence number
+        self.__sequence = 0
+
+        size = _HEADER.size + capacity * _RECORD.size
+
+        fd = eintr_retry(os.open)(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            header = eintr_retry(os.read)(fd, _HEADER.size)
+
+            valid = (
+                len(header) == _HEADER.size and
+                _LAYOUT.unpack_from(header) == (_MAGIC, _VERSION, _RECORD.size, capacity) and
+                os.fstat(fd).st_size == size)
+
+            if not valid:
+                if header:
+                    LOG.warning("Stats snapshot %s has an incompatible layout. Reinitializing it.", path)
+
+                eintr_retry(os.ftruncate)(fd, 0)
+                eintr_retry(os.ftruncate)(fd, size)
+
+            self.__map = mmap.mmap(fd, size)
+
+            if valid:
+                self.__sequence, = _SEQUENCE.unpack_from(self.__map, _SEQUENCE_OFFSET)
+
+                # The previous writer may have crashed in the middle of a
+                # modification: make the sequence even again, or readers would
+                # wait for the modification to complete forever
+                if self.__sequence & 1:
+                    self.__sequence += 1
+                    _SEQUENCE.pack_into(self.__map, _SEQUENCE_OFFSET, self.__sequence)
+            else:
+                _HEADER.pack_into(self.__map, 0,
+                    _MAGIC, _VERSION, _RECORD.size, capacity, 0, 0, 0)
+        except EnvironmentError as e:
+            raise Error("Unable to open stats snapshot {0}: {1}.", path, os.strerror(e.errno or errno.EIO))
+        finally:
+            eintr_retry(os.close)(fd)
+
+        for index in range(capacity - 1, -1, -1):
+            value_type, host, name = _RECORD.unpack_from(
+                self.__map, self.__offset(index))[:3]
+
+            if value_type == _TYPE_FREE:
+                self.__free.append(index)
+            else:
+                self.__records[(_decode(host), _decode(name))] = index
+
+
+    def get_records(self):
+        """Returns a list of (host, metric name, time, value) tuples."""
+
+        records = []
+
+        for (host, name), index in self.__records.items():
+            value_type, _, _, value_time, value = _RECORD.unpack_from(
+                self.__map, self.__offset(index))
+
+            if value_type == _TYPE_INT:
+                value = int(value)
+
+            records.append((host, name, value_time, value))
+
+        return records
+
+
+    def set_monitor(self, pid, start_time):
+        """Publishes the monitor's PID and start time."""
+
+        self.__lock()
+
+        try:
+            _MONITOR.pack_into(self.__map, _MONITOR_OFFSET, pid)
+            _START_TIME.pack_into(self.__map, _START_TIME_OFFSET, start_time)
+        finally:
+            self.__unlock()
+
+
+    def update(self, host, name, value_time, value):
+        """Updates the metric value.
+
+        Metrics with too long names and new metrics when the snapshot is full
+        are skipped (with an error logged once per metric).
+        """
+
+        encoded_host = host.encode("utf-8")
+        encoded_name = name.encode("utf-8")
+
+        key = (host, name)
+        index = self.__records.get(key)
+
+        if index is None:
+            if key in self.__skipped:
+                return
+
+            if len(encoded_host) > MAX_NAME_SIZE or len(encoded_name) > MAX_NAME_SIZE:
+                error = "the name is too long"
+            elif not self.__free:
+                error = "the snapshot is full"
+            else:
+                error = None
+
+            if error is not None:
+                LOG.error("Unable to save %s:%s to stats snapshot: %s.", host, name, error)
+                self.__skipped.add(key)
+                return
+
+            index = self.__records[key] = self.__free.pop()
+
+        self.__lock()
+
+        try:
+            _RECORD.pack_into(self.__map, self.__offset(index),
+                _TYPE_FLOAT if type(value) is float else _TYPE_INT,
+                encoded_host, encoded_name, value_time, value)
+        finally:
+            self.__unlock()
+
+
+    def remove(self, host, name):
+        """Removes the metric from the snapshot."""
+
+        self.__skipped.discard((host, name))
+        index = self.__records.pop((host, name), None)
+
+        if index is not None:
+            self.__lock()
+
+            try:
+                _RECORD.pack_into(self.__map, self.__offset(index), _TYPE_FREE, b"", b"", 0, 0)
+            finally:
+                self.__unlock()
+
+            self.__free.append(index)
+
+
+    def close(self):
+        """Closes the snapshot."""
+
+        self.__map.close()
+
+
+    def __offset(self, index):
+        """Returns an offset of the specified record."""
+
+        return _HEADER.size + index * _RECORD.size
+
+
+    def __lock(self):
+        """Starts a modification (makes the sequence number odd)."""
+
+        self.__sequence += 1
+        _SEQUENCE.pack_into(self.__map, _SEQUENCE_OFFSET, self.__sequence)
+
+
+    def __unlock(self):
+        """Ends a modification (makes the sequence number even)."""
+
+        self.__sequence += 1
+        _SEQUENCE.pack_into(self.__map, _SEQUENCE_OFFSET, self.__sequence)
+
+
+
+def read_snapshot(path):
+    """Reads a snapshot without any locking (see the module's docstring).
+
+    Returns a (monitor's PID, monitor's start time, records) tuple where records
+    is a list of (host, metric name, time, value) tuples. The PID is 0 if the
+    monitor hasn't published it yet.
+    """
+
+    try:
+        with open(path, "rb") as snapshot_file:
+            snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError) as e:
+        raise Error("Unable to open stats snapshot {0}: {1}.", path,
+            os.strerror(e.errno) if getattr(e, "errno", None) else e)
+
+    try:
+        if len(snapshot_map) < _HEADER.size:
+            raise Error("Stats snapshot {0} is corrupted.", path)
+
+        magic, version, record_size, capacity = _LAYOUT.unpack_from(snapshot_map)
+
+        if (
+            (magic, version, record_size) != (_MAGIC, _VERSION, _RECORD.size) or
+            len(snapshot_map) != _HEADER.size + capacity * _RECORD.size
+        ):
+            raise Error("Stats snapshot {0} has an unsupported layout.", path)
+
+        for attempt in range(_READ_ATTEMPTS):
+            sequence, = _SEQUENCE.unpack_from(snapshot_map, _SEQUENCE_OFFSET)
+
+            if not sequence & 1:
+                data = snapshot_map[:]
+
+                if _SEQUENCE.unpack_from(snapshot_map, _SEQUENCE_OFFSET)[0] == sequence:
+                    break
+
+            time.sleep(0)
+        else:
+            raise Error("Unable to read a consistent stats snapshot from {0}.", path)
+    finally:
+        snapshot_map.close()
+
+    pid, = _MONITOR.unpack_from(data, _MONITOR_OFFSET)
+    start_time, = _START_TIME.unpack_from(data, _START_TIME_OFFSET)
+
+    records = []
+
+    for offset in range(_HEADER.size, len(data), _RECORD.size):
+        value_type, host, name, value_time, value = _RECORD.unpack_from(data, offset)
+
+        if value_type != _TYPE_FREE:
+            records.append((_decode(host), _decode(name), value_time,
+                int(value) if value_type == _TYPE_INT else value))
+
+    return pid, start_time, records
+
+
+def _decode(name):
+    """Decodes a null-padded name."""
+
+    return name.rstrip(b"\0").decode("utf-8", "replace")
@@ -2,13 +2,15 @@
 
 from __future__ import unicode_literals
 
+import os
 import re
 
 from pcore import str
 
 import python_config
 
-from xbee.common.core import Error
+from xbee.common.core import Error, LogicalError
+from xbee.monitor.frame import API_MODES, API_MODE_UNESCAPED
 
 
 HOSTS = set()
@@ -17,12 +19,64 @@ HOSTS = set()
 ADDRESSES = {}
 """Sensor MAC address to host mappings."""
 
+CHANNELS = {}
+"""
+Host -> (analog channels, digital channels) mappings, where analog channels is
+a tuple of (channel, metric name, conversion table, no sensor sample) and
+digital channels is a tuple of (channel, metric name). No sensor sample is the
+sample value which means that the sensor isn't connected (None if there is no
+such value).
+"""
 
-def load():
-    """Loads the configuration file."""
+RAW_CHANNELS = True
+"""Whether raw samples of all channels are stored as adcN/dioN metrics."""
+
+DEVICES = {}
+"""Serial device (link name or path) -> serial port settings mappings."""
+
+DEFAULT_DEVICE_SETTINGS = {
+    "baudrate":     9600,
+    "flow_control": None,
+    "vmin":         0,
+    "vtime":        0,
+    "low_latency":  False,
+    "api_mode":     API_MODE_UNESCAPED,
+}
+"""Default serial port settings."""
+
+_FLOW_CONTROLS = (None, "rtscts", "xonxoff")
+"""Supported serial port flow control types."""
+
+AGGREGATE_WINDOWS = (60, 300, 900)
+"""Time windows (in seconds) for which metric aggregates are maintained."""
+
+
+ADC_MAX_VALUE = 1023
+"""Maximum value of an analog sample (XBee 868 ADCs are 10-bit)."""
+
+_ANALOG_CHANNEL_RE = re.compile(r"^adc([0-7])$")
+"""Analog channel name regular expression."""
+
+_DIGITAL_CHANNEL_RE = re.compile(r"^dio([0-9]|1[0-5])$")
+"""Digital channel name regular expression."""
+
+_DEFAULT_CHANNELS = {
+    "adc1": { "name": "temperature", "conversion": "temperature" },
+}
+"""Channel configuration for hosts that don't have it in the config."""
+
+
+def load(optional=False):
+    """Loads the configuration file.
+
+    If optional is True, a missing configuration file is not an error.
+    """
 
     path = "/etc/xbee-monitor.conf"
 
+    if optional and not os.path.exists(path):
+        return
+
     config = python_config.load(path)
 
     try:
@@ -32,10 +86,99 @@ def load():
 
     global HOSTS
     global ADDRESSES
+    global CHANNELS
+    global DEVICES
+    global RAW_CHANNELS
+    global AGGREGATE_WINDOWS
 
     HOSTS.update(config["hosts"])
     ADDRESSES.update(
         (int(address, 16), host) for host, address in config["hosts"].items())
+    CHANNELS.update(
+        (host, _compile_channels(config.get("channels", {}).get(host, _DEFAULT_CHANNELS)))
+        for host in config["hosts"])
+    DEVICES.update(
+        (device, dict(DEFAULT_DEVICE_SETTINGS, **settings))
+        for device, settings in config.get("devices", {}).items())
+
+    RAW_CHANNELS = config.get("raw_channels", RAW_CHANNELS)
+
+    if "aggregate_windows" in config:
+        AGGREGATE_WINDOWS = tuple(sorted(set(config["aggregate_windows"])))
+
+
+def get_device_settings(device):
+    """
+    Returns serial port settings for the specified device (device path or its
+    link name).
+    """
+
+    settings = DEVICES.get(device)
+
+    if settings is None:
+        settings = DEVICES.get(os.path.basename(device), DEFAULT_DEVICE_SETTINGS)
+
+    return settings
+
+
+def _compile_channels(channels):
+    """Compiles channel configuration of a host."""
+
+    analog = []
+    digital = []
+
+    for channel_name, channel in sorted(channels.items()):
+        match = _ANALOG_CHANNEL_RE.search(channel_name)
+
+        if match:
+            analog.append((int(match.group(1)), channel["name"], _compile_conversion(channel),
+                # TMP36 output never reaches the ADC's reference voltage, so
+                # the maximum value means a floating input
+                ADC_MAX_VALUE if channel.get("conversion") == "temperature" else None))
+        else:
+            channel_id = int(_DIGITAL_CHANNEL_RE.search(channel_name).group(1))
+            digital.append((channel_id, channel["name"]))
+
+    return tuple(analog), tuple(digital)
+
+
+def _compile_conversion(channel):
+    """
+    Compiles a conversion of an analog channel to a table with a converted
+    value for each possible sample value (None for invalid values).
+    """
+
+    conversion = channel.get("conversion", "linear")
+
+    if conversion == "linear":
+        scale = channel.get("scale", 1)
+        offset = channel.get("offset", 0)
+        return tuple(value * scale + offset for value in range(ADC_MAX_VALUE + 1))
+    elif conversion == "table":
+        points = sorted(channel["table"])
+        return tuple(_interpolate(points, value) for value in range(ADC_MAX_VALUE + 1))
+    elif conversion == "temperature":
+        max_voltage = 2.5
+        return tuple(
+            int((float(value) / ADC_MAX_VALUE * max_voltage - 0.5) * 100)
+            for value in range(ADC_MAX_VALUE)) + (None,)
+    else:
+        raise LogicalError()
+
+
+def _interpolate(points, value):
+    """
+    Linearly interpolates the value using a sorted list of (sample value,
+    converted value) points. Returns None if the value is out of the points
+    range.
+    """
+
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        if x1 <= value <= x2:
+            return y1 + float(value - x1) * (y2 - y1) / (x2 - x1)
+
+    if len(points) == 1 and points[0][0] == value:
+        return points[0][1]
 
 
 def _validate_config(config):
@@ -53,3 +196,140 @@ def _validate_config(config):
 
         if type(address) is not str or not re.search("^[0-9a-zA-Z]{16}$", address):
             raise Error("Invalid XBee sensor address ({0}) - it must be a 64-bit hex value (string).", address)
+
+    channels = config.get("channels", {})
+
+    if type(channels) is not dict:
+        raise Error("CHANNELS must be a dictionary.")
+
+    for host, host_channels in channels.items():
+        if host not in config["hosts"]:
+            raise Error("CHANNELS: unknown host {0}.", host)
+
+        if type(host_channels) is not dict:
+            raise Error("CHANNELS: channels of {0} must be a dictionary.", host)
+
+        names = set()
+
+        for channel_name, channel in host_channels.items():
+            _validate_channel(host, channel_name, channel)
+
+            if channel["name"] in names:
+                raise Error("CHANNELS: {0} has several channels with {1} metric name.",
+                    host, channel["name"])
+
+            names.add(channel["name"])
+
+    if type(config.get("raw_channels", RAW_CHANNELS)) is not bool:
+        raise Error("RAW_CHANNELS must be a boolean.")
+
+    devices = config.get("devices", {})
+
+    if type(devices) is not dict:
+        raise Error("DEVICES must be a dictionary.")
+
+    for device, settings in devices.items():
+        _validate_device_settings(device, settings)
+
+    windows = config.get("aggregate_windows", AGGREGATE_WINDOWS)
+
+    if (
+        type(windows) not in (list, tuple) or not windows or
+        any(type(window) is not int or window <= 0 for window in windows)
+    ):
+        raise Error("AGGREGATE_WINDOWS must be a non-empty list of positive integers.")
+
+
+def _validate_channel(host, channel_name, channel):
+    """Validates a channel configuration."""
+
+    where = "CHANNELS: {0}: {1}".format(host, channel_name)
+
+    analog = type(channel_name) is str and _ANALOG_CHANNEL_RE.search(channel_name)
+    if not analog and (type(channel_name) is not str or not _DIGITAL_CHANNEL_RE.search(channel_name)):
+        raise Error("{0}: invalid channel name - it must be adc0-adc7 or dio0-dio15.", where)
+
+    if type(channel) is not dict:
+        raise Error("{0}: channel configuration must be a dictionary.", where)
+
+    if type(channel.get("name")) is not str or not channel["name"]:
+        raise Error("{0}: metric name must be a non-empty string.", where)
+
+    if not analog:
+        if set(channel) != set(("name",)):
+            raise Error("{0}: digital channels don't support conversions.", where)
+
+        return
+
+    conversion = channel.get("conversion", "linear")
+
+    if conversion == "linear":
+        options = ("scale", "offset")
+
+        for option in options:
+            if type(channel.get(option, 0)) not in (int, float):
+                raise Error("{0}: {1} must be a number.", where, option)
+    elif conversion == "table":
+        options = ("table",)
+
+        table = channel.get("table")
+        if (
+            type(table) not in (list, tuple) or not table or
+            any(
+                type(point) not in (list, tuple) or len(point) != 2 or
+                any(type(value) not in (int, float) for value in point)
+                for point in table
+            ) or
+            len(set(point[0] for point in table)) != len(table)
+        ):
+            raise Error("{0}: table must be a list of (sample value, metric value) "
+                "pairs with unique sample values.", where)
+    elif conversion == "temperature":
+        options = ()
+    else:
+        raise Error("{0}: invalid conversion: {1}.", where, conversion)
+
+    unknown = set(channel) - set(("name", "conversion") + options)
+    if unknown:
+        raise Error("{0}: unknown options: {1}.", where, ", ".join(sorted(unknown)))
+
+
+def _validate_device_settings(device, settings):
+    """Validates serial port settings of a device."""
+
+    where = "DEVICES: {0}".format(device)
+
+    if type(device) is not str or not device:
+        raise Error("DEVICES: invalid device name: {0}.", device)
+
+    if type(settings) is not dict:
+        raise Error("{0}: device settings must be a dictionary.", where)
+
+    unknown = set(settings) - set(DEFAULT_DEVICE_SETTINGS)
+    if unknown:
+        raise Error("{0}: unknown options: {1}.", where, ", ".join(sorted(unknown)))
+
+    baudrate = settings.get("baudrate", DEFAULT_DEVICE_SETTINGS["baudrate"])
+    if type(baudrate) is not int or baudrate <= 0:
+        raise Error("{0}: baud rate must be a positive integer.", where)
+
+    if settings.get("flow_control") not in _FLOW_CONTROLS:
+        raise Error("{0}: flow control must be one of: {1}.", where,
+            ", ".join(str(flow_control) for flow_control in _FLOW_CONTROLS))
+
+    for option in ("vmin", "vtime"):
+        value = settings.get(option, 0)
+        if type(value) is not int or not 0 <= value <= 255:
+            raise Error("{0}: {1} must be an integer in [0, 255] range.", where, option)
+
+    # vtime bounds the delay of the last bytes of a burst that are less than
+    # vmin bytes (see sensor._configure_read_batching())
+    if settings.get("vmin", 0) and not settings.get("vtime", 0):
+        raise Error("{0}: vmin > 0 requires vtime > 0.", where)
+
+    if type(settings.get("low_latency", False)) is not bool:
+        raise Error("{0}: low_latency must be a boolean.", where)
+
+    if settings.get("api_mode", API_MODE_UNESCAPED) not in API_MODES:
+        raise Error("{0}: API mode must be one of: {1}.", where,
+            ", ".join(str(api_mode) for api_mode in API_MODES))
@@ -0,0 +1,592 @@
+"""XBee 868 API frame parsing."""
+
+from __future__ import unicode_literals
+
+import array
+import logging
+import struct
+import sys
+
+from pcore import PY3
+
+from xbee.common.buffer import Buffer
+from xbee.common.core import Error
+from xbee.common.histogram import Histogram, COUNT_BUCKETS
+
+LOG = logging.getLogger(__name__)
+
+
+FRAME_DELIMITER = 0x7E
+"""XBee 868 frame delimiter."""
+
+MAX_FRAME_SIZE = 100
+"""
+Maximum frame size limit - just to detect broken frames and not read a lot of
+data which takes a lot of time before we get a checksum mismatch error.
+"""
+
+_FRAME_DELIMITER_BYTE = b"\x7E"
+"""XBee 868 frame delimiter as a byte string."""
+
+API_MODE_UNESCAPED = 1
+"""API mode 1 (AP=1): frame data is sent as is."""
+
+API_MODE_ESCAPED = 2
+"""
+API mode 2 (AP=2): frame delimiter, escape, XON and XOFF bytes in frame size,
+data and checksum are escaped.
+"""
+
+API_MODES = (API_MODE_UNESCAPED, API_MODE_ESCAPED)
+"""Supported API modes."""
+
+ESCAPE = 0x7D
+"""API mode 2 escape byte."""
+
+ESCAPE_XOR = 0x20
+"""API mode 2 escaped bytes are XORed with this value."""
+
+ESCAPED_BYTES = (FRAME_DELIMITER, ESCAPE, 0x11, 0x13)
+"""Bytes that are escaped in API mode 2."""
+
+_ESCAPE_BYTE = b"\x7D"
+"""API mode 2 escape byte as a byte string."""
+
+_HEADER_SIZE = 3
+"""Frame header size: delimiter + 16-bit frame size."""
+
+
+FRAME_TYPE_AT_RESPONSE = 0x88
+"""AT Command Response frame type."""
+
+FRAME_TYPE_MODEM_STATUS = 0x8A
+"""Modem Status frame type."""
+
+FRAME_TYPE_TX_STATUS = 0x8B
+"""Transmit Status frame type."""
+
+FRAME_TYPE_RX_PACKET = 0x90
+"""Receive Packet frame type."""
+
+FRAME_TYPE_IO_SAMPLE = 0x92
+"""IO Data Sample Rx Indicator frame type."""
+
+FRAME_TYPE_REMOTE_AT_RESPONSE = 0x97
+"""Remote AT Command Response frame type."""
+
+FRAME_TYPE_NAMES = {
+    FRAME_TYPE_AT_RESPONSE:        "at_response",
+    FRAME_TYPE_MODEM_STATUS:       "modem_status",
+    FRAME_TYPE_TX_STATUS:          "tx_status",
+    FRAME_TYPE_RX_PACKET:          "rx_packet",
+    FRAME_TYPE_IO_SAMPLE:          "io_sample",
+    FRAME_TYPE_REMOTE_AT_RESPONSE: "remote_at_response",
+}
+"""Names of the supported frame types."""
+
+MODEM_STATUSES = {
+    0x00: "hardware_reset",
+    0x01: "watchdog_timer_reset",
+    0x0B: "network_woke_up",
+    0x0C: "network_went_to_sleep",
+}
+"""Modem status names."""
+
+DELIVERY_STATUSES = {
+    0x00: "success",
+    0x01: "mac_ack_failure",
+    0x21: "network_ack_failure",
+    0x25: "route_not_found",
+    0x31: "internal_resource_error",
+    0x32: "internal_error",
+    0x74: "payload_too_large",
+    0x75: "indirect_message_unrequested",
+}
+"""Transmit delivery status names."""
+
+AT_COMMAND_STATUSES = {
+    0x00: "ok",
+    0x01: "error",
+    0x02: "invalid_command",
+    0x03: "invalid_parameter",
+    0x04: "tx_failure",
+}
+"""AT command status names."""
+
+
+_AT_RESPONSE_HEADER = struct.Struct(b"!BB2sB")
+"""AT command response header: frame type, frame ID, AT command, status."""
+
+_MODEM_STATUS = struct.Struct(b"!BB")
+"""Modem status frame: frame type, status."""
+
+_TX_STATUS = struct.Struct(b"!BBHBBB")
+"""
+Transmit status frame: frame type, frame ID, reserved, transmit retry count,
+delivery status, discovery status.
+"""
+
+_RX_PACKET_HEADER = struct.Struct(b"!BQHB")
+"""
+Receive packet header: frame type, source address, network address, receive
+options.
+"""
+
+_REMOTE_AT_RESPONSE_HEADER = struct.Struct(b"!BBQH2sB")
+"""
+Remote AT command response header: frame type, frame ID, source address,
+network address, AT command, status.
+"""
+
+_IO_SAMPLE_HEADER = struct.Struct(b"!BQHBBHB")
+"""
+IO sample frame header: frame type, source address, network address, receive
+options, number of samples, digital channel mask, analog channel mask.
+"""
+
+def _mask_channels(mask, shift=0):
+    """Returns a tuple of channel numbers enabled in the mask."""
+
+    return tuple(bit + shift for bit in range(8) if mask & (1 << bit))
+
+_DIGITAL_CHANNELS_LOW = tuple(_mask_channels(mask) for mask in range(256))
+"""Enabled digital channels for each value of the low digital mask byte."""
+
+_DIGITAL_CHANNELS_HIGH = tuple(_mask_channels(mask, 8) for mask in range(256))
+"""Enabled digital channels for each value of the high digital mask byte."""
+
+_ANALOG_CHANNELS = _DIGITAL_CHANNELS_LOW
+"""Enabled analog channels for each value of the analog channel mask."""
+
+_SAMPLE_SIZE = 2
+"""Size of a digital samples word or an analog sample."""
+
+_SAMPLE_SET = tuple(
+    tuple(
+        struct.Struct(b"!" + b"H" * (digital + len(channels)))
+        for digital in (0, 1))
+    for channels in _ANALOG_CHANNELS)
+"""
+Single sample set decoders for each value of the analog channel mask: without
+and with digital samples.
+"""
+
+_SWAP_SAMPLES = sys.byteorder == "little"
+"""Whether big-endian samples have to be byte-swapped after loading."""
+
+
+class InvalidFrameError(Error):
+    """Invalid frame error."""
+
+    def __init__(self, *args, **kwargs):
+        super(InvalidFrameError, self).__init__(*args, **kwargs)
+
+
+
+class FrameParser(object):
+    """XBee 868 API frame parser.
+
+    Extracts all complete frames from a buffer in one pass and leaves only the
+    trailing partial frame in it.
+
+    In API mode 2 each chunk of data is unescaped as a whole (escape sequences
+    may span chunks) into an internal buffer which is then parsed as API mode 1
+    data, so frame and byte counters refer to unescaped data.
+
+    After a frame error the parser resynchronises: it hunts for the next
+    delimiter with bytearray.find() and accepts a candidate frame only if its
+    length field is valid and its checksum matches. On a false positive it
+    backtracks to the byte after the candidate's delimiter, so the candidate's
+    bytes are scanned again without being read again.
+    """
+
+    def __init__(self, api_mode=API_MODE_UNESCAPED):
+        if api_mode not in API_MODES:
+            raise Error("Invalid API mode: {0}.", api_mode)
+
+        # Unescaped data (in API mode 2)
+        self.__unescaped = Buffer() if api_mode == API_MODE_ESCAPED else None
+
+        # Whether the last unescaped chunk has ended with an escape byte
+        self.__escaped = False
+
+        # Number of successfully parsed frames
+        self.frames = 0
+
+        # Number of parsed bytes
+        self.bytes = 0
+
+        # Number of bytes that have been skipped while looking for a valid
+        # frame
+        self.skipped_bytes = 0
+
+        # Number of frames with checksum mismatch
+        self.checksum_errors = 0
+
+        # Number of times the parser had to resynchronise after a frame error
+        self.resyncs = 0
+
+        # Number of candidate frames rejected while resynchronising
+        self.false_candidates = 0
+
+        # Number of bytes skipped and candidate frames rejected per
+        # resynchronisation
+        self.resync_bytes = Histogram(COUNT_BUCKETS)
+        self.resync_candidates = Histogram(COUNT_BUCKETS)
+
+        # Bytes skipped and candidates rejected in the current
+        # resynchronisation (None if the parser is synchronised)
+        self.__resync = None
+
+
+    def parse(self, buf, handler):
+        """Parses all complete frames in the buffer.
+
+        handler(frame) is called for each frame with a memoryview (a bytearray
+        on Python 2) of the frame data (API identifier + frame-specific data
+        without checksum). The handler may raise InvalidFrameError to reject
+        the frame.
+
+        All parsed frames and skipped bytes are consumed from the buffer.
+        Returns a (frames, skipped bytes) tuple for this call.
+        """
+
+        if self.__unescaped is not None:
+            self.__unescape(buf)
+            buf = self.__unescaped
+
+        view = buf.view()
+        size = len(view)
+        pos = 0
+        frames = 0
+        skipped_bytes = 0
+
+        try:
+            while pos < size:
+                frame_start = buf.find(_FRAME_DELIMITER_BYTE, pos)
+
+                if frame_start == -1:
+                    skipped_bytes += size - pos
+                    pos = size
+                    break
+
+                skipped_bytes += frame_start - pos
+                pos = frame_start
+
+                if size - pos < _HEADER_SIZE:
+                    break
+
+                frame_size = view[pos + 1] << 8 | view[pos + 2]
+
+                if not frame_size or frame_size > MAX_FRAME_SIZE:
+                    self.__frame_error("Got an invalid frame size: {0}.".format(frame_size), skipped_bytes)
+                    skipped_bytes += 1
+                    pos += 1
+                    continue
+
+                data_start = pos + _HEADER_SIZE
+                data_end = data_start + frame_size
+
+                # Wait for the frame data + checksum
+                if data_end >= size:
+                    break
+
+                frame = view[data_start:data_end]
+
+                if checksum(frame) != view[data_end]:
+                    self.checksum_errors += 1
+                    self.__frame_error("Frame checksum mismatch.", skipped_bytes)
+                    skipped_bytes += 1
+                    pos += 1
+                    continue
+
+                if self.__resync is not None:
+                    self.__resynchronised(skipped_bytes)
+
+                try:
+                    handler(frame)
+                except InvalidFrameError as e:
+                    self.__frame_error(e, skipped_bytes)
+                    skipped_bytes += 1
+                    pos += 1
+                    continue
+
+                frames += 1
+                pos = data_end + 1
+        finally:
+            del view
+            buf.consume(pos)
+
+            self.frames += frames
+            self.bytes += pos
+            self.skipped_bytes += skipped_bytes
+
+            if self.__resync is not None:
+                self.__resync[0] += skipped_bytes
+
+        if skipped_bytes:
+            LOG.debug("%s bytes has been skipped.", skipped_bytes)
+
+        return frames, skipped_bytes
+
+
+    def __unescape(self, buf):
+        """Moves API mode 2 data from the buffer to the unescaped data buffer.
+
+        The data is split by escape bytes at once and only the first byte of
+        each part is unescaped, so the cost is proportional to the number of
+        escape sequences rather than to the data size.
+        """
+
+        # Split a bytearray to get integer items on Python 2 too
+        parts = bytearray(buf.view()).split(_ESCAPE_BYTE)
+        buf.clear()
+
+        escaped = self.__escaped
+
+        if len(parts) == 1 and not escaped:
+            self.__unescaped.extend(parts[0])
+            return
+
+        data = bytearray()
+
+        for index, part in enumerate(parts):
+            if index:
+                if escaped:
+                    # An escaped escape byte (the XBee always sends it as
+                    # 0x7D 0x5D, but handle it consistently)
+                    data.append(ESCAPE ^ ESCAPE_XOR)
+                    escaped = False
+                else:
+                    escaped = True
+
+            if escaped and part:
+                # A frame delimiter can't be escaped - it means that the escape
+                # byte belongs to a broken frame, so leave the delimiter as is
+                # to resynchronise on it.
+                if part[0] != FRAME_DELIMITER:
+                    part[0] ^= ESCAPE_XOR
+
+                escaped = False
+
+            data += part
+
+        self.__escaped = escaped
+        self.__unescaped.extend(data)
+
+
+    def __frame_error(self, error, skipped_bytes):
+        """Handles a frame error.
+
+        skipped_bytes is the number of bytes skipped by the current parse()
+        call so far.
+        """
+
+        if self.__resync is None:
+            LOG.error("Error while processing a frame: %s", error)
+            self.resyncs += 1
+
+            # The resynchronisation cost is accounted as bytes skipped by the
+            # current call after this point, so subtract the bytes skipped
+            # before it.
+            self.__resync = [ -skipped_bytes, 0 ]
+        else:
+            LOG.debug("Rejected a candidate frame: %s", error)
+            self.__resync[1] += 1
+            self.false_candidates += 1
+
+
+    def __resynchronised(self, skipped_bytes):
+        """
+        Called when a valid frame is found after a frame error. skipped_bytes
+        is the number of bytes skipped by the current parse() call so far.
+        """
+
+        skipped, candidates = self.__resync
+        self.__resync = None
+
+        self.resync_bytes.add(skipped + skipped_bytes)
+        self.resync_candidates.add(candidates)
+
+        LOG.debug("Resynchronised after %s bytes and %s rejected candidate frames.",
+            skipped + skipped_bytes, candidates)
+
+
+
+def escape(data):
+    """Escapes the data for API mode 2 (see ESCAPED_BYTES)."""
+
+    escaped = bytearray()
+
+    for byte in bytearray(data):
+        if byte in ESCAPED_BYTES:
+            escaped.append(ESCAPE)
+            escaped.append(byte ^ ESCAPE_XOR)
+        else:
+            escaped.append(byte)
+
+    return bytes(escaped)
+
+
+def checksum(frame):
+    """Calculates checksum of the frame data."""
+
+    return 0xFF - ( sum(frame) & 0b11111111 )
+
+
+def decode_io_sample(frame):
+    """Decodes an IO sample frame.
+
+    Returns a (source address, network address, receive options, digital
+    samples, analog samples) tuple, where digital samples is a {channel:
+    array("B")} dictionary and analog samples is a {channel: array("H")}
+    dictionary with a sample vector for each enabled channel. Sample vectors
+    of single-sample frames are 1-tuples.
+    """
+
+    _check_frame_size(frame, _IO_SAMPLE_HEADER.size, exact=False)
+
+    frame_type, address, network_address, receive_options, \
+    samples_number, digital_mask, analog_mask = _IO_SAMPLE_HEADER.unpack_from(frame)
+    offset = _IO_SAMPLE_HEADER.size
+
+    if frame_type != FRAME_TYPE_IO_SAMPLE:
+        raise InvalidFrameError("Got an unexpected frame type: {0:#x}.", frame_type)
+
+    if not samples_number:
+        raise InvalidFrameError("Got an IO sample frame without samples.")
+
+    analog_channels = _ANALOG_CHANNELS[analog_mask]
+
+    # Most frames carry a single sample set, so don't build the sample arrays
+    # for them
+    if samples_number == 1:
+        decoder = _SAMPLE_SET[analog_mask][bool(digital_mask)]
+        _check_frame_size(frame, offset + decoder.size)
+        samples = decoder.unpack_from(frame, offset)
+
+        digital = {}
+        if digital_mask:
+            digital_samples = samples[0]
+            samples = samples[1:]
+
+            for channel in (
+                _DIGITAL_CHANNELS_LOW[digital_mask & 0xFF] +
+                _DIGITAL_CHANNELS_HIGH[digital_mask >> 8]
+            ):
+                digital[channel] = ((digital_samples >> channel) & 1,)
+
+        analog = {}
+        for channel, sample in zip(analog_channels, samples):
+            analog[channel] = (sample,)
+
+        return address, network_address, receive_options, digital, analog
+
+    stride = len(analog_channels) + bool(digital_mask)
+    _check_frame_size(frame, offset + samples_number * stride * _SAMPLE_SIZE)
+
+    # Each sample set is an optional digital samples word followed by enabled
+    # analog channel samples, so decode all of them at once and then split
+    # them by channels.
+    samples = array.array(str("H"))
+    if PY3:
+        samples.frombytes(frame[offset:])
+    else:
+        samples.fromstring(bytes(bytearray(frame[offset:])))
+    if _SWAP_SAMPLES:
+        samples.byteswap()
+
+    digital = {}
+    if digital_mask:
+        digital_samples = samples[::stride]
+
+        for channel in (
+            _DIGITAL_CHANNELS_LOW[digital_mask & 0xFF] +
+            _DIGITAL_CHANNELS_HIGH[digital_mask >> 8]
+        ):
+            digital[channel] = array.array(str("B"),
+                [(value >> channel) & 1 for value in digital_samples])
+
+    analog = {}
+    for index, channel in enumerate(analog_channels, bool(digital_mask)):
+        analog[channel] = samples[index::stride]
+
+    return address, network_address, receive_options, digital, analog
+
+
+def decode_at_response(frame):
+    """Decodes an AT command response frame.
+
+    Returns a (frame ID, AT command, status, data) tuple.
+    """
+
+    _check_frame_size(frame, _AT_RESPONSE_HEADER.size, exact=False)
+
+    frame_type, frame_id, command, status = _AT_RESPONSE_HEADER.unpack_from(frame)
+
+    return frame_id, command.decode("ascii", "replace"), status, \
+        bytes(bytearray(frame[_AT_RESPONSE_HEADER.size:]))
+
+
+def decode_modem_status(frame):
+    """Decodes a modem status frame. Returns the status."""
+
+    _check_frame_size(frame, _MODEM_STATUS.size)
+
+    frame_type, status = _MODEM_STATUS.unpack_from(frame)
+    return status
+
+
+def decode_tx_status(frame):
+    """Decodes a transmit status frame.
+
+    Returns a (frame ID, transmit retry count, delivery status, discovery
+    status) tuple.
+    """
+
+    _check_frame_size(frame, _TX_STATUS.size)
+
+    frame_type, frame_id, reserved, retry_count, delivery_status, discovery_status = \
+        _TX_STATUS.unpack_from(frame)
+
+    return frame_id, retry_count, delivery_status, discovery_status
+
+
+def decode_rx_packet(frame):
+    """Decodes a receive packet frame.
+
+    Returns a (source address, network address, receive options, data) tuple.
+    """
+
+    _check_frame_size(frame, _RX_PACKET_HEADER.size, exact=False)
+
+    frame_type, address, network_address, receive_options = \
+        _RX_PACKET_HEADER.unpack_from(frame)
+
+    return address, network_address, receive_options, \
+        bytes(bytearray(frame[_RX_PACKET_HEADER.size:]))
+
+
+def decode_remote_at_response(frame):
+    """Decodes a remote AT command response frame.
+
+    Returns a (frame ID, source address, network address, AT command, status,
+    data) tuple.
+    """
+
+    _check_frame_size(frame, _REMOTE_AT_RESPONSE_HEADER.size, exact=False)
+
+    frame_type, frame_id, address, network_address, command, status = \
+        _REMOTE_AT_RESPONSE_HEADER.unpack_from(frame)
+
+    return frame_id, address, network_address, command.decode("ascii", "replace"), \
+        status, bytes(bytearray(frame[_REMOTE_AT_RESPONSE_HEADER.size:]))
+
+
+def _check_frame_size(frame, size, exact=True):
+    """Checks the frame size."""
+
+    if len(frame) < size:
+        raise InvalidFrameError("End of frame has been reached.")
+    elif exact and len(frame) != size:
+        raise InvalidFrameError("Frame size is too big for its payload.")
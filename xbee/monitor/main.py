@@ -1,6 +1,6 @@
 """The monitor's main module."""
 
-from __future__ import unicode_literals
+from __future__ import print_function, unicode_literals
 
 import argparse
 import errno
@@ -15,28 +15,50 @@ from psys import eintr_retry
 import xbee.common.log
 import xbee.common.io_loop
 from xbee import common
+from xbee.common.core import Error, LogicalError
 
 import xbee.monitor.config
 import xbee.monitor.sensor
 import xbee.monitor.server
 import xbee.monitor.stats
 from xbee import monitor
+from xbee.monitor.frame import API_MODES, API_MODE_UNESCAPED
 
 xbee # Suppress PyFlakes warnings
 
+_RESCAN_INTERVAL = 10
+"""Interval between serial device rescans."""
+
+_WATCHED_RESCAN_INTERVAL = 5 * 60
+"""Interval between serial device rescans when device connections are watched."""
+
+_LOOPS = ("epoll", "asyncio", "uvloop")
+"""Available I/O loop implementations."""
+
 LOG = logging.getLogger("xbee.monitor.main" if __name__ == "__main__" else __name__)
 
 
-class _MainLoop(common.io_loop.IoLoop):
-    """The monitor's main loop."""
+class _MainLoop(object):
+    """The monitor's main loop.
 
-    def __init__(self):
-        super(_MainLoop, self).__init__()
+    Is mixed into an I/O loop implementation (see _create_main_loop()).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(_MainLoop, self).__init__(*args, **kwargs)
 
         try:
+            monitor.stats.load_snapshot()
             monitor.server.Server(self)
+
+            # When device connections are watched, the periodic rescan is only
+            # a safety net
+            self.__rescan_interval = (
+                _WATCHED_RESCAN_INTERVAL if monitor.sensor.watch(self)
+                else _RESCAN_INTERVAL)
+
             self.__deferred_call = self.call_next(self.__connect_to_sensors)
-            monitor.stats.monitor_started()
+            monitor.stats.monitor_started(self)
         except:
             self.close()
             raise
@@ -46,6 +68,7 @@ class _MainLoop(common.io_loop.IoLoop):
         """Stops the I/O loop."""
 
         self.cancel_call(self.__deferred_call)
+        monitor.sensor.stop(self)
         super(_MainLoop, self).stop()
 
 
@@ -55,22 +78,23 @@ class _MainLoop(common.io_loop.IoLoop):
         try:
             monitor.sensor.connect(self)
         finally:
-            self.__deferred_call = self.call_after(10, self.__connect_to_sensors)
+            self.__deferred_call = self.call_after(
+                self.__rescan_interval, self.__connect_to_sensors)
 
 
 
 class _TerminationSignal(common.io_loop.FileObject):
     """UNIX termination signal monitor."""
 
+    edge_triggered = True
+
+    priority = common.io_loop.PRIORITY_HIGH
+
     def __init__(self, io_loop, fd):
         super(_TerminationSignal, self).__init__(
             io_loop, os.fdopen(fd, "rb"), "Termination signal monitor")
 
-
-    def poll_read(self):
-        """Returns True if we need to poll the file for read availability."""
-
-        return True
+        self._set_interest(read=True)
 
 
     def on_read(self):
@@ -88,9 +112,35 @@ def main():
     parser = argparse.ArgumentParser(description="XBee monitor")
     parser.add_argument("-d", "--debug", action="store_true",
         help="print debug messages")
+    parser.add_argument("--loop", choices=_LOOPS, default=_LOOPS[0],
+        help="I/O loop implementation (default: %(default)s)")
+    parser.add_argument("--edge-triggered", action="store_true",
+        help="use edge-triggered epoll mode (epoll loop only)")
+    parser.add_argument("--budget", metavar="SECONDS", type=float,
+        help="time budget for one I/O loop iteration (epoll loop only)")
+    parser.add_argument("--workers", action="store_true",
+        help="read each device in a separate worker process")
+    parser.add_argument("--replay", metavar="FILE",
+        help="replay a captured serial stream through the frame parser, print "
+             "the statistics and exit")
+    parser.add_argument("--replay-baudrate", metavar="BAUDRATE", type=int,
+        help="pace the replayed stream to the baud rate (default: maximum speed)")
+    parser.add_argument("--replay-api-mode", metavar="MODE", type=int, choices=API_MODES,
+        default=API_MODE_UNESCAPED, help="XBee API mode of the replayed stream (default: %(default)s)")
 
     args = parser.parse_args()
 
+    if args.loop != "epoll":
+        if args.edge_triggered:
+            parser.error("--edge-triggered is supported only by the epoll loop.")
+
+        if args.budget is not None:
+            parser.error("--budget is supported only by the epoll loop.")
+
+    if args.replay is not None:
+        _replay(args.replay, args.replay_baudrate, args.replay_api_mode, args.debug)
+        return
+
     try:
         monitor.config.load()
         common.log.setup("xbee-monitor", debug_mode=args.debug)
@@ -99,8 +149,12 @@ def main():
 
     LOG.info("Starting the daemon...")
 
+    if args.workers:
+        monitor.sensor.use_workers()
+
     try:
-        with _MainLoop() as io_loop:
+        with _create_main_loop(args.loop,
+            edge_triggered=args.edge_triggered, budget=args.budget) as io_loop:
             signals = (signal.SIGINT, signal.SIGTERM, signal.SIGQUIT)
             read_fd, write_fd = os.pipe()
 
@@ -122,6 +176,56 @@ def main():
         LOG.error("The daemon has crashed: %s", e)
 
 
+def _replay(path, baudrate, api_mode, debug_mode):
+    """Replays a captured serial stream."""
+
+    from xbee.monitor import replay
+
+    # The configuration is needed only to handle samples of known hosts
+    try:
+        monitor.config.load(optional=True)
+    except Exception as e:
+        sys.exit("Unable to replay the stream: {0}".format(e))
+
+    if debug_mode:
+        common.log.setup("xbee-monitor", debug_mode=True)
+    else:
+        # Don't log a message for each broken frame or unknown address
+        logging.basicConfig(level=logging.CRITICAL)
+
+    try:
+        stats = replay.replay_file(path, baudrate=baudrate, api_mode=api_mode)
+    except Exception as e:
+        sys.exit("Unable to replay the stream: {0}".format(e))
+
+    print(replay.format_stats(stats))
+
+
+def _create_main_loop(loop, edge_triggered=False, budget=None):
+    """Creates the monitor's main loop using the specified implementation."""
+
+    if loop == "epoll":
+        return type(str("_EpollMainLoop"), (_MainLoop, common.io_loop.IoLoop), {})(
+            edge_triggered=edge_triggered, budget=budget)
+
+    from xbee.common.asyncio_loop import AsyncioIoLoop
+
+    if loop == "asyncio":
+        asyncio_loop = None
+    elif loop == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            raise Error("uvloop module is not installed.")
+
+        asyncio_loop = uvloop.new_event_loop()
+    else:
+        raise LogicalError()
+
+    return type(str("_AsyncioMainLoop"), (_MainLoop, AsyncioIoLoop), {})(
+        loop=asyncio_loop)
+
+
 def _configure_termination_signals(io_loop, signals, read_fd, write_fd):
     """Configures UNIX termination signal handling."""
 
@@ -0,0 +1,187 @@
+"""Records raw XBee 868 frames for debugging.
+
+The recorded frames may be dumped via the dump_frames request and decoded
+offline:
+
+    python -m xbee.monitor.recorder DUMP_FILE
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import base64
+import binascii
+import datetime
+import json
+import struct
+import sys
+import time
+
+from xbee.common import constants
+from xbee.common.core import Error
+
+from xbee.monitor.frame import (InvalidFrameError, MAX_FRAME_SIZE,
+    FRAME_TYPE_IO_SAMPLE, FRAME_TYPE_NAMES, decode_io_sample)
+
+
+_RECORD_HEADER = struct.Struct(b"!dH")
+"""Record header: frame receive time, frame size."""
+
+_RECORD_SIZE = _RECORD_HEADER.size + MAX_FRAME_SIZE
+"""Size of a record slot."""
+
+
+class FrameRecorder(object):
+    """A ring buffer that records the last received frames.
+
+    Each frame is stored in a fixed-size preallocated slot, so recording
+    is only a struct.pack_into() call and a slice assignment.
+    """
+
+    def __init__(self, capacity=constants.FRAME_RECORDER_CAPACITY):
+        # Record storage
+        self.__data = bytearray(capacity * _RECORD_SIZE)
+
+        # Maximum number of records
+        self.__capacity = capacity
+
+        # Index of the next record slot
+        self.__next = 0
+
+        # Number of stored records
+        self.__count = 0
+
+
+    def __len__(self):
+        return self.__count
+
+
+    def record(self, frame, frame_time=None):
+        """
+        Records a frame (frame data without header and checksum) received at
+        frame_time (now if it's None).
+        """
+
+        size = min(len(frame), MAX_FRAME_SIZE)
+        offset = self.__next * _RECORD_SIZE + _RECORD_HEADER.size
+
+        _RECORD_HEADER.pack_into(self.__data, offset - _RECORD_HEADER.size,
+            time.time() if frame_time is None else frame_time, size)
+        self.__data[offset:offset + size] = frame[:size]
+
+        self.__next = (self.__next + 1) % self.__capacity
+        if self.__count < self.__capacity:
+            self.__count += 1
+
+
+    def dump(self):
+        """
+        Returns the recorded frames in chronological order as a sequence of
+        (header, frame data) records.
+        """
+
+        dump = bytearray()
+        first = (self.__next - self.__count) % self.__capacity
+
+        for index in range(self.__count):
+            offset = (first + index) % self.__capacity * _RECORD_SIZE
+            frame_time, size = _RECORD_HEADER.unpack_from(self.__data, offset)
+            dump += self.__data[offset:offset + _RECORD_HEADER.size + size]
+
+        return bytes(dump)
+
+
+
+def parse_dump(dump):
+    """Parses a frame dump. Yields (time, frame data) tuples."""
+
+    offset = 0
+
+    while offset < len(dump):
+        if len(dump) - offset < _RECORD_HEADER.size:
+            raise Error("The frame dump is truncated.")
+
+        frame_time, size = _RECORD_HEADER.unpack_from(dump, offset)
+        offset += _RECORD_HEADER.size
+
+        if len(dump) - offset < size:
+            raise Error("The frame dump is truncated.")
+
+        yield frame_time, dump[offset:offset + size]
+        offset += size
+
+
+def format_frame(frame_time, frame):
+    """Returns a human-readable representation of a recorded frame."""
+
+    lines = [ "{0}: {1}".format(
+        datetime.datetime.fromtimestamp(frame_time).isoformat(),
+        " ".join("{0:02x}".format(byte) for byte in bytearray(frame))) ]
+
+    if not frame:
+        lines.append("  Empty frame.")
+    elif bytearray(frame)[0] == FRAME_TYPE_IO_SAMPLE:
+        try:
+            address, network_address, receive_options, digital, analog = \
+                decode_io_sample(frame)
+        except InvalidFrameError as e:
+            lines.append("  Invalid IO sample frame: {0}".format(e))
+        else:
+            lines.append("  IO sample from {0:016X} ({1:04X}), receive options: {2:#04x}.".format(
+                address, network_address, receive_options))
+            lines.extend("  Digital channel {0}: {1}.".format(
+                channel, " ".join(str(value) for value in samples))
+                for channel, samples in sorted(digital.items()))
+            lines.extend("  Analog channel {0}: {1}.".format(
+                channel, " ".join("{0:04X}".format(value) for value in samples))
+                for channel, samples in sorted(analog.items()))
+    else:
+        frame_type = bytearray(frame)[0]
+        lines.append("  Frame type {0:#04x} ({1}).".format(
+            frame_type, FRAME_TYPE_NAMES.get(frame_type, "unknown")))
+
+    return "\n".join(lines)
+
+
+def main():
+    """Pretty-prints frame dumps."""
+
+    parser = argparse.ArgumentParser(description="XBee frame dump decoder")
+    parser.add_argument("dump", nargs="?", default="-", help=
+        "a base64-encoded frame dump or a dump_frames request response "
+        "(default: standard input)")
+
+    args = parser.parse_args()
+
+    try:
+        if args.dump == "-":
+            data = sys.stdin.read()
+        else:
+            with open(args.dump) as dump_file:
+                data = dump_file.read()
+
+        try:
+            dumps = json.loads(data)
+        except ValueError:
+            dumps = { None: data }
+        else:
+            if not isinstance(dumps, dict):
+                raise Error("Invalid dump_frames response.")
+
+        for device, dump in sorted(dumps.items()):
+            if device is not None:
+                print("{0}:".format(device))
+
+            try:
+                dump = base64.b64decode(dump.strip())
+            except (TypeError, ValueError, binascii.Error) as e:
+                raise Error("Invalid frame dump: {0}.", e)
+
+            for frame_time, frame in parse_dump(dump):
+                print(format_frame(frame_time, frame))
+    except Exception as e:
+        sys.exit("Error: {0}".format(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Replays captured serial streams through the sensor frame parser.
+
+Allows to measure the parsing throughput without hardware:
+
+    python -m xbee.monitor.replay generate FILE [--frames N] [--corruption RATE] [--api-mode MODE] [--address ADDRESS]
+    python -m xbee.monitor.replay replay FILE [--baudrate BAUDRATE] [--api-mode MODE]
+
+or via xbee-monitor --replay FILE.
+
+The configuration file is optional. If it's present, samples from the
+configured hosts are handled as by the monitor (generate frames with an
+address from HOSTS to measure this path too).
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import fcntl
+import logging
+import os
+import random
+import struct
+import sys
+import threading
+import time
+
+from psys import eintr_retry
+
+from xbee.common.core import Error
+from xbee.common.io_loop import IoLoop, monotonic_time
+
+from xbee.monitor import config, sensor
+from xbee.monitor.frame import (API_MODES, API_MODE_ESCAPED, API_MODE_UNESCAPED,
+    FRAME_DELIMITER, FRAME_TYPE_IO_SAMPLE, checksum, escape)
+
+LOG = logging.getLogger(__name__)
+
+
+_CHUNK_SIZE = 64
+"""Size of data chunks that are written to the sensor."""
+
+_DEFAULT_ADDRESS = 0x0013A20040A1B2C3
+"""Default source address of generated frames."""
+
+_IO_SAMPLE_HEADER = struct.Struct(b"!BQHBBHB")
+"""IO sample frame header (see xbee.monitor.frame)."""
+
+
+def replay(data, baudrate=None, chunk_size=_CHUNK_SIZE, api_mode=API_MODE_UNESCAPED):
+    """Replays a captured serial stream.
+
+    The data is written to a pipe by a separate thread and is read and parsed
+    by a _Sensor in an I/O loop. If baudrate is specified, the data is paced to
+    the serial port speed (10 bits per byte), otherwise it's written at the
+    maximum speed. api_mode is the XBee API mode the data has been captured in.
+
+    Returns the replay statistics.
+    """
+
+    read_fd, write_fd = os.pipe()
+
+    try:
+        fcntl.fcntl(read_fd, fcntl.F_SETFL, os.O_NONBLOCK)
+        source = os.fdopen(read_fd, "rb", 0)
+    except:
+        eintr_retry(os.close)(read_fd)
+        eintr_retry(os.close)(write_fd)
+        raise
+
+    writer = threading.Thread(target=_write,
+        args=(write_fd, data, None if baudrate is None else baudrate / 10.0, chunk_size))
+
+    stats = {}
+
+    with IoLoop() as io_loop:
+        replay_sensor = sensor._Sensor(io_loop, "replay", source, api_mode=api_mode)
+        replay_sensor.add_on_close_handler(lambda: stats.update(replay_sensor.get_stats()))
+
+        start_time = monotonic_time()
+        start_cpu_time = _cpu_time()
+
+        writer.start()
+
+        try:
+            io_loop.start()
+
+            cpu_time = _cpu_time() - start_cpu_time
+            elapsed = monotonic_time() - start_time
+        finally:
+            # Closing the pipe's read end stops the writer if we've crashed
+            io_loop.close()
+            writer.join()
+
+    frames = stats["frames"]
+
+    return {
+        "size":               len(data),
+        "time":               elapsed,
+        "frames":             frames,
+        "frames_per_second":  frames / elapsed if elapsed > 0 else None,
+        "bytes_per_second":   stats["bytes"] / elapsed if elapsed > 0 else None,
+        "skipped_bytes":      stats["skipped_bytes"],
+        "checksum_errors":    stats["checksum_errors"],
+        "resyncs":            stats["resyncs"],
+        "false_candidates":   stats["false_candidates"],
+        "resync_bytes":       stats["resync_bytes"],
+        "cpu_time":           cpu_time,
+        "cpu_time_per_frame": cpu_time / frames if frames else None,
+    }
+
+
+def replay_file(path, baudrate=None, api_mode=API_MODE_UNESCAPED):
+    """Replays a captured serial stream from the specified file."""
+
+    try:
+        with open(path, "rb") as capture:
+            data = capture.read()
+    except EnvironmentError as e:
+        raise Error("Unable to read '{0}': {1}.", path, e.strerror)
+
+    return replay(data, baudrate=baudrate, api_mode=api_mode)
+
+
+def format_stats(stats):
+    """Returns a human-readable representation of replay statistics."""
+
+    return "\n".join((
+        "Replayed {0} bytes in {1:.3f} seconds.".format(stats["size"], stats["time"]),
+        "Frames: {0} ({1:.0f} frames/sec, {2:.0f} bytes/sec).".format(
+            stats["frames"], stats["frames_per_second"] or 0, stats["bytes_per_second"] or 0),
+        "Skipped bytes: {0}, checksum errors: {1}, resyncs: {2}.".format(
+            stats["skipped_bytes"], stats["checksum_errors"], stats["resyncs"]),
+        "Resync cost: {0:.1f} bytes/resync (max {1}), {2} false candidate frames.".format(
+            stats["resync_bytes"]["avg"] or 0, stats["resync_bytes"]["max"] or 0,
+            stats["false_candidates"]),
+        "CPU time: {0:.3f} seconds ({1:.1f} us/frame).".format(
+            stats["cpu_time"], (stats["cpu_time_per_frame"] or 0) * 1000000),
+    ))
+
+
+def generate(frames, corruption=0, address=_DEFAULT_ADDRESS, analog_mask=0b00000010,
+             digital_mask=0, samples=1, seed=None, api_mode=API_MODE_UNESCAPED):
+    """Generates a synthetic stream of IO sample frames.
+
+    corruption is a probability of each frame to be corrupted: a flipped byte,
+    a truncated frame or garbage (possibly with frame delimiters) before the
+    frame. In API mode 2 the frames are corrupted before escaping.
+    """
+
+    rand = random.Random(seed)
+    channels = bin(analog_mask).count("1") + bool(digital_mask)
+    stream = bytearray()
+
+    for frame_id in range(frames):
+        data = bytearray(_IO_SAMPLE_HEADER.pack(FRAME_TYPE_IO_SAMPLE, address, 0xFFFE,
+            0x01, samples, digital_mask, analog_mask))
+
+        for sample in range(samples * channels):
+            data += struct.pack(b"!H", rand.randint(0, 1023))
+
+        frame = bytearray(struct.pack(b"!H", len(data)))
+        frame += data
+        frame.append(checksum(data))
+
+        if corruption and rand.random() < corruption:
+            kind = rand.randint(0, 2)
+
+            if kind == 0:
+                frame[rand.randrange(len(frame))] ^= 1 << rand.randint(0, 7)
+            elif kind == 1:
+                del frame[rand.randrange(len(frame)):]
+            else:
+                stream += bytearray(rand.choice((FRAME_DELIMITER, rand.randint(0, 255)))
+                    for garbage_byte in range(rand.randint(1, 16)))
+
+        stream.append(FRAME_DELIMITER)
+        stream += escape(frame) if api_mode == API_MODE_ESCAPED else frame
+
+    return bytes(stream)
+
+
+def main():
+    """Generates and replays serial streams."""
+
+    parser = argparse.ArgumentParser(description="XBee serial stream replay")
+    subparsers = parser.add_subparsers(dest="command")
+
+    generate_parser = subparsers.add_parser("generate", help="generate a synthetic stream")
+    generate_parser.add_argument("path", metavar="FILE", help="output file")
+    generate_parser.add_argument("--frames", type=int, default=100000,
+        help="number of frames (default: %(default)s)")
+    generate_parser.add_argument("--samples", type=int, default=1,
+        help="number of samples per frame (default: %(default)s)")
+    generate_parser.add_argument("--corruption", type=float, default=0,
+        help="probability of frame corruption (default: %(default)s)")
+    generate_parser.add_argument("--seed", type=int, help="random seed")
+    generate_parser.add_argument("--api-mode", type=int, choices=API_MODES,
+        default=API_MODE_UNESCAPED, help="XBee API mode (default: %(default)s)")
+    generate_parser.add_argument("--address", type=_address, default=_DEFAULT_ADDRESS,
+        help="source address of the frames - a 64-bit hex value (default: {0:016X})".format(
+            _DEFAULT_ADDRESS))
+
+    replay_parser = subparsers.add_parser("replay", help="replay a stream")
+    replay_parser.add_argument("path", metavar="FILE", help="captured serial stream")
+    replay_parser.add_argument("--baudrate", type=int,
+        help="pace the stream to the baud rate (default: maximum speed)")
+    replay_parser.add_argument("--api-mode", type=int, choices=API_MODES,
+        default=API_MODE_UNESCAPED, help="XBee API mode (default: %(default)s)")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "generate":
+            data = generate(args.frames, corruption=args.corruption,
+                address=args.address, samples=args.samples, seed=args.seed,
+                api_mode=args.api_mode)
+
+            with open(args.path, "wb") as stream:
+                stream.write(data)
+        elif args.command == "replay":
+            logging.basicConfig(level=logging.CRITICAL)
+            config.load(optional=True)
+            print(format_stats(replay_file(args.path,
+                baudrate=args.baudrate, api_mode=args.api_mode)))
+        else:
+            parser.error("Command is not specified.")
+    except Exception as e:
+        sys.exit("Error: {0}".format(e))
+
+
+def _address(value):
+    """Parses a 64-bit hex address."""
+
+    try:
+        address = int(value, 16)
+    except ValueError:
+        address = -1
+
+    if not 0 <= address < 1 << 64:
+        raise argparse.ArgumentTypeError("invalid address: {0}".format(value))
+
+    return address
+
+
+def _write(fd, data, bytes_per_second, chunk_size):
+    """Writes the data to the pipe."""
+
+    try:
+        data = memoryview(data)
+        start_time = monotonic_time()
+
+        for offset in range(0, len(data), chunk_size):
+            if bytes_per_second is not None:
+                delay = start_time + offset / bytes_per_second - monotonic_time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            chunk = data[offset:offset + chunk_size]
+            while chunk:
+                chunk = chunk[eintr_retry(os.write)(fd, chunk):]
+    except Exception as e:
+        LOG.error("Failed to replay the stream: %s.", e)
+    finally:
+        eintr_retry(os.close)(fd)
+
+
+def _cpu_time():
+    """Returns CPU time of the current thread (if supported)."""
+
+    thread_time = getattr(time, "thread_time", None)
+    return time.clock() if thread_time is None else thread_time()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ import logging
 
 from xbee.common.core import Error
 
+import xbee.monitor.sensor
 import xbee.monitor.stats
 from xbee import monitor
 
@@ -48,8 +49,71 @@ def _metrics(host):
     return monitor.stats.get_metrics(host)
 
 
+@_handler("history")
+def _history(host, metric, window=None):
+    """
+    Returns (time, value) pairs of the metric values recorded over the last
+    window seconds (all recorded values if window is not specified).
+    """
+
+    return monitor.stats.get_history(host, metric,
+        None if window is None else _parse_window(window))
+
+
+@_handler("aggregate")
+def _aggregate(host, metric, window):
+    """
+    Returns count, min, max and avg of the metric values recorded over the
+    last window seconds.
+    """
+
+    return monitor.stats.get_aggregate(host, metric, _parse_window(window))
+
+
 @_handler("uptime")
 def _uptime():
     """Returns monitor service uptime."""
 
     return monitor.stats.get_uptime()
+
+
+@_handler("radio_stats")
+def _radio_stats():
+    """Returns radio traffic statistics."""
+
+    return monitor.stats.get_radio_stats()
+
+
+@_handler("loop_stats")
+def _loop_stats():
+    """Returns the monitor's I/O loop statistics."""
+
+    return monitor.stats.get_loop_stats()
+
+
+@_handler("sensor_stats")
+def _sensor_stats():
+    """Returns statistics of the connected sensors."""
+
+    return monitor.sensor.get_stats()
+
+
+@_handler("dump_frames")
+def _dump_frames():
+    """Returns the last received frames of the connected sensors."""
+
+    return monitor.sensor.dump_frames()
+
+
+def _parse_window(window):
+    """Parses a time window request parameter."""
+
+    try:
+        window = int(window)
+    except ValueError:
+        window = 0
+
+    if window <= 0:
+        raise Error("Invalid window: it must be a positive number of seconds.")
+
+    return window
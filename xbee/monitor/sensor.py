@@ -2,105 +2,166 @@
 
 from __future__ import unicode_literals
 
+import base64
+import binascii
 import errno
 import logging
 import os
 import serial
-import struct
+import termios
+import time
 
-from pcore import PY3
+from functools import partial
 
-from xbee.common.core import Error, LogicalError
-from xbee.common.io_loop import FileObject
+from xbee.common.core import Error
+from xbee.common.histogram import Histogram, COUNT_BUCKETS
+from xbee.common.inotify import (Inotify, IN_CREATE, IN_DELETE, IN_IGNORED,
+    IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR, IN_Q_OVERFLOW)
+from xbee.common.io_loop import FileObject, PRIORITY_HIGH, monotonic_time
 
 import xbee.monitor.stats
 from xbee.monitor import config
+from xbee.monitor.frame import (FrameParser, InvalidFrameError,
+    FRAME_TYPE_AT_RESPONSE, FRAME_TYPE_IO_SAMPLE, FRAME_TYPE_MODEM_STATUS,
+    FRAME_TYPE_NAMES, FRAME_TYPE_REMOTE_AT_RESPONSE, FRAME_TYPE_RX_PACKET,
+    FRAME_TYPE_TX_STATUS, AT_COMMAND_STATUSES, DELIVERY_STATUSES, MODEM_STATUSES,
+    decode_at_response, decode_io_sample, decode_modem_status,
+    decode_remote_at_response, decode_rx_packet, decode_tx_status)
+from xbee.monitor.recorder import FrameRecorder, format_frame
 from xbee import monitor
 
 xbee # Suppress PyFlakes warnings
 
 
-_FRAME_DELIMITER = 0x7E
-"""XBee 868 frame delimiter."""
+_DEVICE_NAME = "XBee 868"
+"""Name of the supported devices."""
 
-_MAX_FRAME_SIZE = 100
-"""
-Maximum frame size limit - just to detect broken frames and not read a lot of
-data which takes a lot of time before we get a checksum mismatch error.
-"""
+_DEVICE_DIRECTORY = "/dev/serial/by-id"
+"""Directory with serial device links."""
 
 
-_STATE_FIND_FRAME_HEADER = "find-frame-header"
-"""State for finding a frame header."""
+_ANALOG_METRICS = tuple("adc{0}".format(channel) for channel in range(8))
+"""Raw analog sample metric names."""
 
-_STATE_RECV_FRAME_HEADER = "receive-frame-header"
-"""State for receiving a frame header."""
+_DIGITAL_METRICS = tuple("dio{0}".format(channel) for channel in range(16))
+"""Raw digital sample metric names."""
 
-_STATE_RECV_FRAME_BODY = "receive-frame-body"
-"""State for receiving a frame body."""
-
-
-LOG = logging.getLogger(__name__)
+_FRAME_HANDLERS = {}
+"""Registered frame handlers."""
 
+_USE_WORKERS = False
+"""Whether devices are read by worker processes."""
 
 
-class _InvalidFrameError(Error):
-    """Invalid frame error."""
-
-    def __init__(self, *args, **kwargs):
-        super(_InvalidFrameError, self).__init__(*args, **kwargs)
+LOG = logging.getLogger(__name__)
 
 
 
 class _Sensor(FileObject):
     """Represents a XBee 868 sensor."""
 
-    sensors = set()
+    edge_triggered = True
+
+    priority = PRIORITY_HIGH
+
+    sensors = {}
     """All opened devices."""
 
+    connecting = set()
+    """Devices that are being opened."""
+
 
-    def __init__(self, io_loop, device):
-        sensor = serial.Serial(device, baudrate=9600)
+    def __init__(self, io_loop, device, sensor, api_mode=None):
+        # sensor is an opened serial port of the device (see _open()). If
+        # api_mode is None, it's taken from the device settings.
 
         try:
-            sensor.nonblocking()
             super(_Sensor, self).__init__(
-                io_loop, sensor, "XBee 868 at " + device)
+                io_loop, sensor, _DEVICE_NAME + " at " + device)
         except:
             sensor.close()
             raise
 
         try:
-            self.__offset = None
-            self.__skipped_bytes = 0
-            self.__frame_size = None
-            self.__set_state(_STATE_FIND_FRAME_HEADER)
-
-            self.add_on_close_handler(lambda: self.sensors.discard(device))
-            self.sensors.add(device)
+            self.__device = device
+            settings = config.get_device_settings(device)
+
+            self.__parser = FrameParser(settings["api_mode"] if api_mode is None else api_mode)
+            self.__recorder = FrameRecorder()
+            self.__connect_time = monotonic_time()
+
+            # When the terminal batches reads (see _configure_read_batching()),
+            # a trailing partial burst is read by a deferred call
+            self.__tail_read_delay = settings["vtime"] / 10.0 if settings["vmin"] else None
+            self.__tail_read = None
+            self.add_on_close_handler(self.__cancel_tail_read)
+
+            # Per-call parsing statistics
+            self.__frames_per_call = Histogram(COUNT_BUCKETS)
+            self.__skipped_bytes_per_call = Histogram(COUNT_BUCKETS)
+
+            self._set_interest(read=True)
+            self.add_on_close_handler(lambda: self.sensors.pop(device, None))
+            self.sensors[device] = self
         except:
             self.close()
             raise
 
 
 
-    def poll_read(self):
-        """Returns True if we need to poll the file for read availability."""
+    def get_stats(self):
+        """Returns the sensor statistics."""
+
+        parser = self.__parser
+        uptime = monotonic_time() - self.__connect_time
 
-        return True
+        return {
+            "device":                 self.__device,
+            "uptime":                 uptime,
+            "frames":                 parser.frames,
+            "frames_per_second":      parser.frames / uptime if uptime > 0 else None,
+            "bytes":                  parser.bytes,
+            "skipped_bytes":          parser.skipped_bytes,
+            "checksum_errors":        parser.checksum_errors,
+            "resyncs":                parser.resyncs,
+            "false_candidates":       parser.false_candidates,
+            "resync_bytes":           parser.resync_bytes.to_dict(),
+            "resync_candidates":      parser.resync_candidates.to_dict(),
+            "frames_per_call":        self.__frames_per_call.to_dict(),
+            "skipped_bytes_per_call": self.__skipped_bytes_per_call.to_dict(),
+        }
+
+
+    def dump_frames(self):
+        """Returns the last received frames (see FrameRecorder.dump())."""
+
+        return self.__recorder.dump()
 
 
     def on_read(self):
         """Called when we have data to read."""
 
-        if self.__state == _STATE_FIND_FRAME_HEADER:
-            self.__find_frame_header()
-        elif self.__state == _STATE_RECV_FRAME_HEADER:
-            self.__receive_frame_header()
-        elif self.__state == _STATE_RECV_FRAME_BODY:
-            self.__receive_frame_body()
-        else:
-            raise LogicalError()
+        buffered = len(self._read_buffer)
+
+        # Serial ports may return no data when there is nothing to read, so
+        # device disconnection is detected only via EPOLLHUP.
+        eof = self._read_available(empty_read_is_eof=False)
+
+        if (
+            self.__tail_read_delay is not None and self.__tail_read is None and
+            len(self._read_buffer) > buffered
+        ):
+            self.__tail_read = self._weak_io_loop().call_after(
+                self.__tail_read_delay, self.__read_tail)
+
+        frames, skipped_bytes = self.__parser.parse(
+            self._read_buffer, self.__handle_frame)
+
+        self.__frames_per_call.add(frames)
+        self.__skipped_bytes_per_call.add(skipped_bytes)
+
+        if eof:
+            raise EOFError("End of file has been reached.")
 
 
 
@@ -111,238 +172,519 @@ class _Sensor(FileObject):
 
 
 
-    def __set_state(self, state):
-        """Sets current state."""
+    def _on_frame(self, frame_type, frame):
+        """Called on each received frame."""
 
-        if state == _STATE_FIND_FRAME_HEADER:
-            LOG.debug("Looking for a frame header...")
-        elif state == _STATE_RECV_FRAME_HEADER:
-            LOG.debug("Receiving a frame header...")
-        elif state == _STATE_RECV_FRAME_BODY:
-            LOG.debug("Receiving a frame body...")
-        else:
-            raise LogicalError()
+        handle_frame(self, frame_type, frame)
 
-        self.__state = state
 
+    def _on_io_sample(self, address, digital, analog):
+        """Called on each received IO sample frame."""
 
-    def __find_frame_header(self):
-        """Finds a frame header."""
+        handle_io_sample(address, digital, analog)
 
-        if not self._read(1):
+
+    def __read_tail(self):
+        """
+        Reads data that hasn't woken us up because it's less than VMIN bytes.
+        """
+
+        self.__tail_read = None
+
+        if self.closed():
             return
 
-        if self._read_buffer[0] == _FRAME_DELIMITER:
-            LOG.debug("Found a frame delimiter. %s bytes has been skipped.", self.__skipped_bytes)
-            self.__set_state(_STATE_RECV_FRAME_HEADER)
-        else:
-            self._clear_read_buffer()
-            self.__skipped_bytes += 1
-            if not self.__skipped_bytes % 100:
-                LOG.debug("Skip %s bytes...", self.__skipped_bytes)
+        try:
+            self.on_read()
+        except Exception as e:
+            if not isinstance(e, (EnvironmentError, EOFError)):
+                LOG.exception("%s handling crashed.", self)
 
+            self.on_error(e)
 
-    def __receive_frame_header(self):
-        """Receives frame header."""
 
-        header_format = b"!BH"
-        header_size = struct.calcsize(header_format)
+    def __cancel_tail_read(self):
+        """Cancels the scheduled tail read."""
 
-        if not self._read(header_size):
-            return
+        io_loop = self._weak_io_loop()
+        if io_loop is not None and self.__tail_read is not None:
+            io_loop.cancel_call(self.__tail_read)
+            self.__tail_read = None
 
-        frame_delimiter, self.__frame_size, = struct.unpack(
-            header_format, bytes(self._read_buffer))
 
-        if frame_delimiter != _FRAME_DELIMITER:
-            self.__handle_frame_error("Got an invalid frame delimiter.")
-        elif self.__frame_size > _MAX_FRAME_SIZE:
-            self.__handle_frame_error("Got a too big frame size.")
-        else:
-            self.__offset = header_size
+    def __handle_frame(self, frame):
+        """Handles a frame."""
 
-            LOG.debug("Got a frame of %s bytes.", self.__frame_size)
-            self.__set_state(_STATE_RECV_FRAME_BODY)
+        self.__recorder.record(frame)
 
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug("%s", format_frame(time.time(), frame))
 
-    def __receive_frame_body(self):
-        """Receives frame body."""
+        if not frame:
+            raise InvalidFrameError("End of frame has been reached.")
 
-        # Receive frame + checksum
-        if not self._read(self.__offset + self.__frame_size + 1):
-            return
+        self._on_frame(frame[0], frame)
+
+
+
+class _DeviceWatcher(Inotify):
+    """
+    Watches the serial device directory and connects/disconnects the devices
+    as soon as their links appear/disappear.
+
+    The device directory and its parent may not exist when no serial devices
+    are connected, so the watcher always watches the two nearest existing
+    directories of /dev/serial/by-id path.
+    """
 
-        checksum = 0xFF - ( sum(byte for byte in self._read_buffer[3:-1]) & 0b11111111 )
-        frame_checksum = self._read_buffer[-1]
+    __directory_mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+    """Mask for the watched directories."""
+
+
+    def __init__(self, io_loop):
+        super(_DeviceWatcher, self).__init__(io_loop, "Serial device watcher")
 
         try:
-            if checksum != frame_checksum:
-                raise _InvalidFrameError("Frame checksum mismatch.")
+            # Watch descriptor -> path mapping
+            self.__watches = {}
 
-            self.__handle_frame()
-        except _InvalidFrameError as e:
-            self.__handle_frame_error(e)
-        else:
-            self._clear_read_buffer()
-            self.__set_state(_STATE_RECV_FRAME_HEADER)
+            self.__update_watches()
+        except:
+            self.close()
+            raise
 
 
-    def __handle_frame(self):
-        """Handles a frame."""
+    def on_event(self, wd, mask, name):
+        """Called on inotify event."""
+
+        if mask & IN_Q_OVERFLOW:
+            LOG.warning("%s: event queue overflow.", self)
+            self.__update_watches()
+            connect(self._weak_io_loop())
+            return
 
-        LOG.debug("Frame: %s", " ".join("{0:02x}".format(c) for c in self._read_buffer))
+        if mask & IN_IGNORED:
+            if self.__watches.pop(wd, None) is not None:
+                self.__update_watches()
+            return
+
+        path = self.__watches.get(wd)
+        if path is None:
+            return
 
-        self.__check_read_buffer(1)
-        frame_type = self._read_buffer[self.__offset]
-        self.__offset += 1
+        if path == _DEVICE_DIRECTORY:
+            if not _is_xbee_device(name):
+                return
 
-        if frame_type == 0x92:
-            self.__handle_metrics_frame()
+            device = os.path.join(_DEVICE_DIRECTORY, name)
+
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                LOG.info("%s has appeared at %s.", _DEVICE_NAME, device)
+                _connect_device(self._weak_io_loop(), device)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                sensor = _Sensor.sensors.get(device)
+                if sensor is not None:
+                    LOG.info("%s at %s has been disconnected.", _DEVICE_NAME, device)
+                    sensor.close()
         else:
-            LOG.debug("Got an unknown frame %#x. Skipping it.", frame_type)
+            child_path = os.path.join(path, name)
 
+            if (
+                _DEVICE_DIRECTORY != child_path and
+                not _DEVICE_DIRECTORY.startswith(child_path + os.sep)
+            ):
+                return
 
-    def __handle_metrics_frame(self):
-        """Handles a metrics frame."""
+            # The device directory or one of its ancestors has appeared or
+            # disappeared
+            self.__update_watches()
 
-        frame = bytes(self._read_buffer)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                connect(self._weak_io_loop())
 
-        frame_format = b"!QH BB HB"
-        self.__check_read_buffer(struct.calcsize(frame_format))
 
-        address, network_address, \
-        receive_options, samples_number, \
-        digital_mask, analog_mask = \
-            struct.unpack_from(frame_format, frame, offset=self.__offset)
-        self.__offset += struct.calcsize(frame_format)
+    def __update_watches(self):
+        """Watches the two nearest existing directories of the device path."""
 
-        LOG.debug("Got a metrics frame:")
-        LOG.debug("Source address: %016X.", address)
-        LOG.debug("Network address: %04X.", network_address)
+        for wd in self.__watches:
+            self.remove_watch(wd)
+        self.__watches.clear()
 
+        path = _DEVICE_DIRECTORY
 
-        LOG.debug("Digital channel mask: %s.", "{0:016b}".format(digital_mask))
+        while len(self.__watches) < 2:
+            try:
+                self.__watches[self.add_watch(path, self.__directory_mask)] = path
+            except EnvironmentError as e:
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise Error("Unable to watch '{0}': {1}.", path, e.strerror)
 
-        if digital_mask:
-            digital_samples_format = b"!H"
-            digital_samples, = struct.unpack_from(
-                digital_samples_format, frame, offset=self.__offset)
-            self.__offset += struct.calcsize(digital_samples_format)
+            if path == os.sep:
+                break
 
-            LOG.debug("Digital samples: %s.", "{0:016b}".format(digital_samples))
+            path = os.path.dirname(path)
 
+        LOG.debug("%s: watching %s.", self, ", ".join(sorted(self.__watches.values())))
 
-        LOG.debug("Analog channel mask: %s.", "{0:08b}".format(analog_mask))
 
-        metrics = {}
-        analog_sample_format = b"!H"
-        analog_sample_size = struct.calcsize(analog_sample_format)
-        analog_mask_shift = 0
 
-        while analog_mask:
-            if analog_mask & 1:
-                self.__check_read_buffer(analog_sample_size)
-                analog_sample, = struct.unpack_from(
-                    analog_sample_format, frame, offset=self.__offset)
-                self.__offset += analog_sample_size
+def use_workers():
+    """Makes the monitor read each device in a separate worker process."""
 
-                LOG.debug("Analog sample for %s: %04X.",
-                    "{0:08b}".format(1 << analog_mask_shift), analog_sample)
+    global _USE_WORKERS
+    _USE_WORKERS = True
 
-                metrics[analog_mask_shift] = analog_sample
 
-            analog_mask >>= 1
-            analog_mask_shift += 1
+def stop(io_loop):
+    """Called when the I/O loop is stopping."""
 
+    if _USE_WORKERS:
+        from xbee.monitor import worker
+        worker.stop(io_loop)
 
-        if self.__offset != len(self._read_buffer) - 1: # -1 for checksum
-            raise _InvalidFrameError("Frame size is too big for its payload.")
 
+def watch(io_loop):
+    """
+    Starts watching for XBee 868 device connections. Returns False if the
+    device watching is not supported on the current system.
+    """
 
-        try:
-            host = config.ADDRESSES[address]
-        except KeyError:
-            LOG.warning("Got metrics for an unknown MAC address: %016X.", address)
-        else:
-            _handle_temperature(host, metrics.get(1))
+    try:
+        _DeviceWatcher(io_loop)
+    except Exception as e:
+        LOG.warning("Unable to watch for %s device connections: %s", _DEVICE_NAME, e)
+        return False
 
+    return True
 
-    def __check_read_buffer(self, size):
-        """
-        Checks the read buffer for availability of the specified bytes of data
-        (counting from current read offset).
-        """
 
-        if self.__offset + size > len(self._read_buffer):
-            raise _InvalidFrameError("End of frame has been reached.")
+def connect(io_loop):
+    """Connects to XBee 868 devices.
+
+    The devices are looked up and opened in the I/O loop's thread pool.
+    """
 
+    LOG.debug("Looking for %s devices...", _DEVICE_NAME)
+    io_loop.run_in_executor(_find_devices, partial(_on_devices_found, io_loop))
 
-    def __handle_frame_error(self, error):
-        """Handles a frame error."""
 
-        LOG.error("Error while processing a frame: %s", error)
+def get_stats():
+    """Returns statistics of all connected sensors."""
 
-        frame_delimiter_pos = self._read_buffer.find(
-            _FRAME_DELIMITER if PY3 else chr(_FRAME_DELIMITER), 1)
+    return [sensor.get_stats() for sensor in _get_sensors().values()]
 
-        if frame_delimiter_pos == -1:
-            self.__skipped_bytes = len(self._read_buffer)
-            self._clear_read_buffer()
-            self.__set_state(_STATE_FIND_FRAME_HEADER)
-        else:
-            LOG.debug("Found a frame delimiter. %s bytes has been skipped.", frame_delimiter_pos)
-            del self._read_buffer[:frame_delimiter_pos]
-            self.__set_state(_STATE_RECV_FRAME_HEADER)
 
+def dump_frames():
+    """Returns base64-encoded dumps of the last frames of all connected sensors."""
 
+    return dict(
+        (device, base64.b64encode(sensor.dump_frames()).decode("ascii"))
+        for device, sensor in _get_sensors().items())
 
-def connect(io_loop):
-    """Connects to XBee 868 devices."""
 
-    device_name = "XBee 868"
-    device_directory = "/dev/serial/by-id"
+def handle_frame(sensor, frame_type, frame):
+    """Handles a frame received by the sensor (or by a worker process)."""
+
+    monitor.stats.add_frame(
+        FRAME_TYPE_NAMES[frame_type] if frame_type in FRAME_TYPE_NAMES
+        else "{0:#04x}".format(frame_type))
+
+    handler = _FRAME_HANDLERS.get(frame_type)
+
+    if handler is None:
+        LOG.debug("Got an unknown frame %#x. Skipping it.", frame_type)
+    else:
+        handler(sensor, frame)
+
+
+def _frame_handler(frame_type):
+    """Registers a frame handler."""
+
+    def register(handler):
+        if frame_type in _FRAME_HANDLERS:
+            raise Error("Handler for frame type {0:#x} is already registered.", frame_type)
+
+        _FRAME_HANDLERS[frame_type] = handler
+        return handler
+
+    return register
+
+
+@_frame_handler(FRAME_TYPE_IO_SAMPLE)
+def _handle_io_sample(sensor, frame):
+    """Handles an IO sample frame."""
+
+    address, network_address, receive_options, digital, analog = \
+        decode_io_sample(frame)
+
+    sensor._on_io_sample(address, digital, analog)
+
+
+@_frame_handler(FRAME_TYPE_RX_PACKET)
+def _handle_rx_packet(sensor, frame):
+    """Handles a receive packet frame."""
+
+    address, network_address, receive_options, data = decode_rx_packet(frame)
+    monitor.stats.add_rx_packet(_source_name(address), len(data))
+
+
+@_frame_handler(FRAME_TYPE_MODEM_STATUS)
+def _handle_modem_status(sensor, frame):
+    """Handles a modem status frame."""
+
+    status = _status_name(MODEM_STATUSES, decode_modem_status(frame))
+
+    LOG.info("Got a modem status: %s.", status)
+    monitor.stats.add_modem_status(status)
+
 
-    LOG.debug("Looking for %s devices...", device_name)
+@_frame_handler(FRAME_TYPE_TX_STATUS)
+def _handle_tx_status(sensor, frame):
+    """Handles a transmit status frame."""
+
+    frame_id, retry_count, delivery_status, discovery_status = decode_tx_status(frame)
+    monitor.stats.add_tx_status(
+        _status_name(DELIVERY_STATUSES, delivery_status), retry_count)
+
+
+@_frame_handler(FRAME_TYPE_AT_RESPONSE)
+def _handle_at_response(sensor, frame):
+    """Handles an AT command response frame."""
+
+    frame_id, command, status, data = decode_at_response(frame)
+    monitor.stats.add_at_response("local", command,
+        _status_name(AT_COMMAND_STATUSES, status), binascii.hexlify(data).decode("ascii"))
+
+
+@_frame_handler(FRAME_TYPE_REMOTE_AT_RESPONSE)
+def _handle_remote_at_response(sensor, frame):
+    """Handles a remote AT command response frame."""
+
+    frame_id, address, network_address, command, status, data = \
+        decode_remote_at_response(frame)
+
+    monitor.stats.add_at_response(_source_name(address), command,
+        _status_name(AT_COMMAND_STATUSES, status), binascii.hexlify(data).decode("ascii"))
+
+
+def _source_name(address):
+    """Returns a name of the frame source with the specified address."""
+
+    return config.ADDRESSES.get(address, "{0:016X}".format(address))
+
+
+def _status_name(names, status):
+    """Returns a name of the status."""
+
+    return names.get(status, "{0:#04x}".format(status))
+
+
+def _find_devices():
+    """Returns a list of connected XBee 868 devices (blocking)."""
 
     try:
-        devices = [
-            os.path.join(device_directory, device)
-            for device in os.listdir(device_directory)
-                if "xbib-u-ss" in device.lower()
+        return [
+            os.path.join(_DEVICE_DIRECTORY, device)
+            for device in os.listdir(_DEVICE_DIRECTORY)
+                if _is_xbee_device(device)
         ]
     except EnvironmentError as e:
         if e.errno == errno.ENOENT:
             LOG.debug("There is no any connected serial devices.")
+            return []
         else:
-            LOG.error("Unable to list connected serial devices: {0}.", e)
+            raise Error("Unable to list connected serial devices: {0}.", e)
+
+
+def _on_devices_found(io_loop, devices, error):
+    """Called when the device lookup completes."""
+
+    if error is not None:
+        LOG.error("%s", error)
+        return
+
+    if io_loop.stopping():
+        return
+
+    for device in devices:
+        _connect_device(io_loop, device)
+
+    if not devices:
+        LOG.debug("There is no any connected %s device.", _DEVICE_NAME)
+
+
+def _connect_device(io_loop, device):
+    """Connects to the specified device if it's not connected yet."""
+
+    if device in _Sensor.sensors or device in _Sensor.connecting:
+        return
+
+    if _USE_WORKERS:
+        from xbee.monitor import worker
+        worker.start(io_loop, device)
+        return
+
+    LOG.info("Connecting to %s at %s...", _DEVICE_NAME, device)
+
+    _Sensor.connecting.add(device)
+    io_loop.run_in_executor(partial(_open, device),
+        partial(_on_device_opened, io_loop, device))
+
+
+def _get_sensors():
+    """
+    Returns a device -> sensor mapping of all connected sensors (workers in
+    worker mode).
+    """
+
+    if _USE_WORKERS:
+        from xbee.monitor import worker
+        return worker._Worker.workers
+
+    return _Sensor.sensors
+
+
+def _is_xbee_device(name):
+    """Checks whether the serial device link name is a XBee 868 device."""
+
+    return "xbib-u-ss" in name.lower()
+
+
+def _open(device):
+    """Opens a serial port of the specified device (blocking)."""
+
+    settings = config.get_device_settings(device)
+
+    sensor = serial.Serial(device, baudrate=settings["baudrate"],
+        rtscts=settings["flow_control"] == "rtscts",
+        xonxoff=settings["flow_control"] == "xonxoff")
+
+    try:
+        if settings["low_latency"]:
+            _set_low_latency_mode(sensor, device)
+
+        _configure_read_batching(sensor.fileno(), settings["vmin"])
+        sensor.nonblocking()
+    except:
+        sensor.close()
+        raise
+
+    return sensor
+
+
+def _configure_read_batching(fd, vmin):
+    """Configures VMIN of the terminal.
+
+    The port is non-blocking, so VMIN doesn't affect reads (a read returns all
+    available data), but with VTIME = 0 the terminal doesn't become readable
+    until at least VMIN bytes are received. This way the number of wakeups is
+    reduced. Linux makes the terminal readable on the first byte when VTIME >
+    0, so VTIME is always 0 and the last bytes of a burst are read by _Sensor
+    after the vtime device setting instead.
+    """
+
+    attrs = termios.tcgetattr(fd)
+    attrs[6][termios.VMIN] = vmin
+    attrs[6][termios.VTIME] = 0
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+
+
+def _set_low_latency_mode(sensor, device):
+    """
+    Enables low latency mode (ASYNC_LOW_LATENCY) of the serial port which
+    disables the latency timer of FTDI adapters.
+    """
+
+    try:
+        sensor.set_low_latency_mode(True)
+    except (AttributeError, NotImplementedError, EnvironmentError, ValueError) as e:
+        LOG.warning("Unable to enable low latency mode for %s: %s", device, e)
+
+
+def _on_device_opened(io_loop, device, sensor, error):
+    """Called when a device opening completes."""
+
+    _Sensor.connecting.discard(device)
+
+    if error is not None:
+        LOG.error("Failed to connect to %s: %s", _DEVICE_NAME, error)
+        return
+
+    if io_loop.stopping():
+        sensor.close()
+        return
+
+    try:
+        _Sensor(io_loop, device, sensor)
+    except Exception as e:
+        LOG.error("Failed to connect to %s: %s", _DEVICE_NAME, e)
     else:
-        for device in devices:
-            if device not in _Sensor.sensors:
-                LOG.info("Connecting to %s at %s...", device_name, device)
-
-                try:
-                    _Sensor(io_loop, device)
-                except Exception as e:
-                    LOG.error("Failed to connect to %s: %s", device_name, e)
-                else:
-                    LOG.info("Connected. Listening to metrics...")
-
-        if not devices:
-            LOG.debug("There is no any connected %s device.", device_name)
-
-
-def _handle_temperature(host, value):
-    """Handles a temperature metric."""
-
-    max_value = 1023
-    max_voltage = 2.5
-
-    if value in (None, max_value):
-        LOG.warning("%s doesn't have a temperature sensor.", host)
-    elif value < max_value:
-        voltage = float(value) / max_value * max_voltage
-        degrees = int((voltage - 0.5) * 100)
-        LOG.info("Got a temperature for %s: %s.", host, degrees)
-        monitor.stats.add_metric(host, "temperature", degrees)
+        LOG.info("Connected. Listening to metrics...")
+
+
+def handle_io_sample(address, digital, analog, sample_time=None):
+    """
+    Handles IO samples of the specified sensor (see decode_io_sample())
+    received at sample_time (now if it's None).
+    """
+
+    try:
+        host = config.ADDRESSES[address]
+    except KeyError:
+        LOG.warning("Got metrics for an unknown MAC address: %016X.", address)
     else:
-        LOG.error("Got an invalid temperature value for %s.", host)
+        _handle_samples(host, digital, analog, sample_time)
+
+
+def _handle_samples(host, digital, analog, sample_time=None):
+    """Handles IO samples of the specified host.
+
+    Each channel has a vector of samples. Only the last valid sample of each
+    channel is stored: the sample rate isn't known, so the earlier samples
+    can't be timestamped and aren't converted.
+    """
+
+    add_metric = monitor.stats.add_metric
+
+    if config.RAW_CHANNELS:
+        for channel, samples in analog.items():
+            add_metric(host, _ANALOG_METRICS[channel], samples[-1], sample_time)
+
+        for channel, samples in digital.items():
+            add_metric(host, _DIGITAL_METRICS[channel], samples[-1], sample_time)
+
+    analog_channels, digital_channels = config.CHANNELS[host]
+
+    for channel, name, table, no_sensor_sample in analog_channels:
+        value = None
+        invalid_samples = []
+
+        for sample in reversed(analog.get(channel, ())):
+            if sample == no_sensor_sample:
+                continue
+
+            if sample < len(table):
+                value = table[sample]
+
+            if value is None:
+                invalid_samples.append(sample)
+            else:
+                break
+
+        if invalid_samples:
+            LOG.error("Got an invalid %s value for %s: %s.", name, host,
+                ", ".join(str(sample) for sample in reversed(invalid_samples)))
+
+        if value is not None:
+            LOG.info("Got %s for %s: %s.", name, host, value)
+            add_metric(host, name, value, sample_time)
+        elif not invalid_samples:
+            LOG.warning("%s doesn't have a %s sensor.", host, name)
+
+    for channel, name in digital_channels:
+        samples = digital.get(channel)
+
+        if samples is None:
+            LOG.warning("%s doesn't have a %s sensor.", host, name)
+        else:
+            add_metric(host, name, samples[-1], sample_time)
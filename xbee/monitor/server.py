@@ -9,12 +9,12 @@ import os
 import socket
 import struct
 
-from pcore import str, bytes
+from pcore import str
 from psys import eintr_retry
 
 from xbee.common import constants
 from xbee.common.core import Error
-from xbee.common.io_loop import FileObject
+from xbee.common.io_loop import FileObject, PRIORITY_LOW
 
 import xbee.monitor.request
 from xbee import monitor
@@ -30,6 +30,10 @@ LOG = logging.getLogger(__name__)
 class Server(FileObject):
     """The monitor server socket."""
 
+    edge_triggered = True
+
+    priority = PRIORITY_LOW
+
     def __init__(self, io_loop):
         self.__client_id = 0
 
@@ -49,6 +53,7 @@ class Server(FileObject):
                 raise Error("Unable to create a UNIX socket '{0}': {1}.", path, e)
 
             super(Server, self).__init__(io_loop, sock, "Monitor's server socket")
+            self._set_interest(read=True)
         except:
             try:
                 self.__delete_socket()
@@ -78,31 +83,29 @@ class Server(FileObject):
         self.close()
 
 
-    def poll_read(self):
-        """Returns True if we need to poll the file for read availability."""
-
-        return True
-
-
     def on_read(self):
         """Called when we have data to read."""
 
-        try:
-            connection = eintr_retry(self._file.accept)()[0]
-        except EnvironmentError as e:
-            if e.errno != errno.ECONNABORTED:
-                LOG.error("Unable to accept a connection: %s.", e)
-        else:
-            connection_name = "Client connection #{0}".format(self.__client_id)
-            self.__client_id += 1
+        while True:
+            try:
+                connection = eintr_retry(self._file.accept)()[0]
+            except EnvironmentError as e:
+                if e.errno == errno.EWOULDBLOCK:
+                    break
+                elif e.errno != errno.ECONNABORTED:
+                    LOG.error("Unable to accept a connection: %s.", e)
+                    break
+            else:
+                connection_name = "Client connection #{0}".format(self.__client_id)
+                self.__client_id += 1
 
-            LOG.debug("Accepting a new %s...", connection_name)
+                LOG.debug("Accepting a new %s...", connection_name)
 
-            try:
-                _Client(self._weak_io_loop(), connection, connection_name)
-            except Exception as e:
-                LOG.error("Failed to accept %s: %s.", connection_name, e)
-                eintr_retry(connection.close())
+                try:
+                    _Client(self._weak_io_loop(), connection, connection_name)
+                except Exception as e:
+                    LOG.error("Failed to accept %s: %s.", connection_name, e)
+                    eintr_retry(connection.close())
 
 
     def __delete_socket(self):
@@ -121,21 +124,24 @@ class Server(FileObject):
 class _Client(FileObject):
     """A client connection socket."""
 
+    edge_triggered = True
+
+    priority = PRIORITY_LOW
+
     __message_size_format = b"!Q"
     """Format of the message size."""
 
     __message_size = None
     """Request message size."""
 
-    __got_request = False
-    """Did we get a request?"""
-
 
     def __init__(self, io_loop, sock, name):
         sock.setblocking(False)
-        super(_Client, self).__init__(io_loop, sock, name)
+        super(_Client, self).__init__(io_loop, sock, name,
+            max_read_buffer_size=struct.calcsize(self.__message_size_format) + _MAX_REQUEST_SIZE)
 
         try:
+            self._set_interest(read=True)
             self.add_deferred_call(
                 io_loop.call_after(constants.IPC_TIMEOUT, self.__on_timed_out))
         except Exception:
@@ -143,34 +149,30 @@ class _Client(FileObject):
             raise
 
 
-    def poll_read(self):
-        """Returns True if we need to poll the file for read availability."""
-
-        return not self.__got_request
-
-
-    def poll_write(self):
-        """Returns True if we need to poll the file for write availability."""
-
-        return self.__got_request
-
-
     def on_read(self):
         """Called when we are able to read."""
 
+        eof = self._read_available()
+
         if self.__message_size is None:
-            if self._read(struct.calcsize(self.__message_size_format)):
-                self.__message_size, = struct.unpack(
-                    self.__message_size_format, bytes(self._read_buffer))
-                self._clear_read_buffer()
+            message_size_length = struct.calcsize(self.__message_size_format)
+
+            if len(self._read_buffer) >= message_size_length:
+                self.__message_size, = struct.unpack_from(
+                    self.__message_size_format, self._read_buffer.view())
+                self._read_buffer.consume(message_size_length)
 
                 if self.__message_size > _MAX_REQUEST_SIZE:
-                    self.on_error("Too big message size has been gotten ({0}).",
-                        self.__message_size)
-        else:
-            if self._read(self.__message_size):
-                self.__got_request = True
-                self.__handle_request()
+                    self.on_error(Error(
+                        "Too big message size has been gotten ({0}).",
+                        self.__message_size))
+                    return
+
+        if self.__message_size is not None and len(self._read_buffer) >= self.__message_size:
+            self._set_interest(read=False, write=True)
+            self.__handle_request()
+        elif eof:
+            raise EOFError("End of file has been reached.")
 
 
     def on_write(self):
@@ -187,11 +189,17 @@ class _Client(FileObject):
         self.close()
 
 
+    def __request_data(self):
+        """Returns the request message."""
+
+        return bytes(self._read_buffer.view(0, self.__message_size))
+
+
     def __handle_request(self):
         """Handles a request."""
 
         try:
-            request = json.loads(self._read_buffer.decode("utf-8"))
+            request = json.loads(self.__request_data().decode("utf-8"))
 
             if (
                 "method" not in request or
@@ -200,7 +208,7 @@ class _Client(FileObject):
             ):
                 raise ValueError()
         except (UnicodeDecodeError, ValueError):
-            LOG.error("%s: got an invalid request %s.", self, bytes(self._read_buffer))
+            LOG.error("%s: got an invalid request %s.", self, self.__request_data())
             self.close()
             return
 
@@ -215,5 +223,5 @@ class _Client(FileObject):
             reply = { "error": str(e) if isinstance(e, Error) else "Internal error" }
 
         response = json.dumps(reply).encode("utf-8")
-        if self._write(struct.pack(self.__message_size_format, len(response)) + response):
+        if self._write(struct.pack(self.__message_size_format, len(response)), response):
             self.close()
@@ -2,29 +2,346 @@
 
 from __future__ import unicode_literals
 
+import array
+import collections
+import logging
+import os
 import time
+import weakref
 
+from xbee.common import constants
 from xbee.common.core import Error
+from xbee.common.snapshot import Snapshot
 
 from xbee.monitor import config
 
+LOG = logging.getLogger(__name__)
+
 
 _MONITOR_START_TIME = None
 """The monitor service start time."""
 
+_IO_LOOP = None
+"""A weak reference to the monitor's I/O loop."""
+
 _METRICS = {}
 """Recorded metrics."""
 
+_HISTORY = {}
+"""Host -> metric name -> _MetricHistory mappings."""
+
+ROLLUP_TIERS = (
+    (60,   60),  # 1 hour by minute
+    (300,  288), # 1 day by 5 minutes
+    (3600, 168), # 1 week by hour
+)
+"""Metric rollup tiers: (bucket resolution in seconds, number of buckets)."""
+
+_SNAPSHOT = None
+"""
+Memory-mapped snapshot of the recorded metrics (is also read by the Nagios
+plugin directly).
+"""
+
+_RADIO_STATS = {
+    "frames":       {},
+    "modem_status": {},
+    "tx_status":    {},
+    "rx_packets":   {},
+    "at_responses": {},
+}
+"""Radio traffic statistics."""
+
+
+class _WindowAggregate(object):
+    """Aggregates of metric values over a time window."""
+
+    __slots__ = ("window", "first", "count", "sum", "min", "max")
+
+    def __init__(self, window):
+        # Window size in seconds
+        self.window = window
+
+        # Index of the first value in the window
+        self.first = 0
+
+        # Number of values in the window and their sum
+        self.count = 0
+        self.sum = 0.0
+
+        # Monotonic deques of value indexes: values of min are ascending and
+        # values of max are descending, so the window's minimum and maximum are
+        # always at their heads.
+        self.min = collections.deque()
+        self.max = collections.deque()
+
+
+
+class _Rollup(object):
+    """Metric value aggregates in fixed time buckets.
+
+    Count, sum, min and max of the values are folded into buckets of the
+    specified resolution which are stored in ring buffers, so the rollup takes
+    constant memory and spans resolution * size seconds.
+    """
+
+    __slots__ = ("resolution", "span", "__size", "__buckets", "__counts", "__sums",
+                 "__mins", "__maxs")
+
+    def __init__(self, resolution, size):
+        # Bucket size in seconds and time span of the rollup
+        self.resolution = resolution
+        self.span = resolution * size
+
+        self.__size = size
+
+        # Bucket numbers (bucket time / resolution) of the ring buffer slots
+        self.__buckets = array.array(str("d"), [-1]) * size
+
+        # Bucket aggregates
+        self.__counts = array.array(str("d"), [0]) * size
+        self.__sums = array.array(str("d"), [0]) * size
+        self.__mins = array.array(str("d"), [0]) * size
+        self.__maxs = array.array(str("d"), [0]) * size
+
+
+    def add(self, value_time, value):
+        """Folds a new value into its bucket."""
+
+        bucket = value_time // self.resolution
+        slot = int(bucket) % self.__size
+
+        if self.__buckets[slot] != bucket:
+            self.__buckets[slot] = bucket
+            self.__counts[slot] = 1
+            self.__sums[slot] = value
+            self.__mins[slot] = value
+            self.__maxs[slot] = value
+        else:
+            self.__counts[slot] += 1
+            self.__sums[slot] += value
+
+            if value < self.__mins[slot]:
+                self.__mins[slot] = value
+            elif value > self.__maxs[slot]:
+                self.__maxs[slot] = value
+
+
+    def get_aggregate(self, window, now):
+        """
+        Returns a (count, sum, min, max) tuple for the buckets that overlap the
+        last window seconds (min and max are None if there are no values).
+        """
+
+        resolution = self.resolution
+        size = self.__size
+        buckets = self.__buckets
+
+        last = now // resolution
+        first = max((now - window) // resolution, last - size + 1)
+
+        count = 0
+        value_sum = 0.0
+        value_min = value_max = None
+
+        bucket = first
+        while bucket <= last:
+            slot = int(bucket) % size
+
+            if buckets[slot] == bucket:
+                count += self.__counts[slot]
+                value_sum += self.__sums[slot]
+
+                if value_min is None or self.__mins[slot] < value_min:
+                    value_min = self.__mins[slot]
+
+                if value_max is None or self.__maxs[slot] > value_max:
+                    value_max = self.__maxs[slot]
+
+            bucket += 1
+
+        return int(count), value_sum, value_min, value_max
+
+
+
+class _MetricHistory(object):
+    """A bounded history of metric values.
+
+    Values and their times are stored in ring buffers. Aggregates over the
+    configured time windows are maintained incrementally on each value addition
+    and expiration, so getting an aggregate takes amortized O(1) time. A window
+    can't contain more values than the history size.
+
+    Values are addressed by their absolute indexes - the ring buffer slot of a
+    value is its index modulo the history size.
+
+    Aggregates over other windows are calculated from the rollups.
+    """
+
+    __slots__ = ("__size", "__times", "__values", "__end", "__aggregates", "__rollups")
+
+    def __init__(self, size, windows):
+        self.__size = size
+
+        # Value times and values
+        self.__times = array.array(str("d"), [0]) * size
+        self.__values = array.array(str("d"), [0]) * size
+
+        # Index of the next value
+        self.__end = 0
+
+        # Window aggregates
+        self.__aggregates = dict((window, _WindowAggregate(window)) for window in windows)
+
+        # Rollups of ROLLUP_TIERS
+        self.__rollups = tuple(_Rollup(resolution, buckets) for resolution, buckets in ROLLUP_TIERS)
+
+
+    def add(self, value_time, value):
+        """Adds a new value."""
+
+        index = self.__end
+        values = self.__values
+        size = self.__size
+
+        for aggregate in self.__aggregates.values():
+            # Free the slot of the new value
+            self.__expire(aggregate, value_time - aggregate.window, index + 1 - size)
+
+        slot = index % size
+        self.__times[slot] = value_time
+        values[slot] = value
+        self.__end = index + 1
+
+        for aggregate in self.__aggregates.values():
+            aggregate.count += 1
+            aggregate.sum += value
+
+            mins = aggregate.min
+            while mins and values[mins[-1] % size] >= value:
+                mins.pop()
+            mins.append(index)
+
+            maxs = aggregate.max
+            while maxs and values[maxs[-1] % size] <= value:
+                maxs.pop()
+            maxs.append(index)
+
+        for rollup in self.__rollups:
+            rollup.add(value_time, value)
+
+
+    def get_aggregate(self, window, now):
+        """Returns aggregates of the values over the specified window.
+
+        Aggregates over the configured windows are exact. For other windows the
+        finest rollup which spans the window is used, so the result covers the
+        window rounded up to the rollup's resolution.
+        """
+
+        aggregate = self.__aggregates.get(window)
+
+        if aggregate is None:
+            rollup = self.__rollups[_get_rollup_tier(window)]
+            count, value_sum, value_min, value_max = rollup.get_aggregate(window, now)
+            resolution = rollup.resolution
+        else:
+            self.__expire(aggregate, now - window, self.__end - self.__size)
+
+            count = aggregate.count
+            value_sum = aggregate.sum
+            resolution = None
+
+            if count:
+                values = self.__values
+                size = self.__size
+
+                value_min = values[aggregate.min[0] % size]
+                value_max = values[aggregate.max[0] % size]
+
+        if not count:
+            return { "window": window, "resolution": resolution, "count": 0,
+                     "min": None, "max": None, "avg": None }
+
+        return {
+            "window":     window,
+            "resolution": resolution,
+            "count":      count,
+            "min":        value_min,
+            "max":        value_max,
+            "avg":        value_sum / count,
+        }
+
+
+    def get_values(self, start_time=None):
+        """
+        Returns a list of (time, value) pairs for the values added after the
+        specified time (all stored values if it's None).
+        """
+
+        times = self.__times
+        values = self.__values
+        size = self.__size
+
+        result = []
+
+        for index in range(self.__end - 1, max(self.__end - size, 0) - 1, -1):
+            slot = index % size
+            if start_time is not None and times[slot] <= start_time:
+                break
+
+            result.append((times[slot], values[slot]))
 
-def monitor_started():
+        result.reverse()
+        return result
+
+
+    def __expire(self, aggregate, expire_time, end):
+        """
+        Removes values older than or equal to the expire time and values with
+        indexes less than end from the window aggregate.
+        """
+
+        times = self.__times
+        values = self.__values
+        size = self.__size
+
+        index = aggregate.first
+        value_sum = aggregate.sum
+
+        while index < self.__end and (index < end or times[index % size] <= expire_time):
+            value_sum -= values[index % size]
+            index += 1
+
+        if index == aggregate.first:
+            return
+
+        aggregate.count -= index - aggregate.first
+        aggregate.first = index
+
+        # Reset the accumulated floating point error when the window is empty
+        aggregate.sum = value_sum if aggregate.count else 0.0
+
+        for deque in (aggregate.min, aggregate.max):
+            while deque and deque[0] < index:
+                deque.popleft()
+
+
+
+def monitor_started(io_loop):
     """Called on the monitor start."""
 
     global _MONITOR_START_TIME
+    global _IO_LOOP
 
     if _MONITOR_START_TIME is not None:
         raise Error("The monitor is already started.")
 
     _MONITOR_START_TIME = time.time()
+    _IO_LOOP = weakref.ref(io_loop)
+
+    if _SNAPSHOT is not None:
+        _SNAPSHOT.set_monitor(os.getpid(), _MONITOR_START_TIME)
 
 
 def get_uptime():
@@ -36,14 +353,72 @@ def get_uptime():
     return int(time.time() - _MONITOR_START_TIME)
 
 
+def get_loop_stats():
+    """Returns the monitor's I/O loop statistics."""
 
-def add_metric(host, name, value):
-    """Adds a new metric."""
+    io_loop = None if _IO_LOOP is None else _IO_LOOP()
+    if io_loop is None:
+        raise Error("The monitor is not started.")
 
-    _METRICS.setdefault(host, {})[name] = {
-        "time":  int(time.time()),
-        "value": value,
-    }
+    return io_loop.get_stats()
+
+
+
+def load_snapshot(path=constants.STATS_SNAPSHOT_PATH):
+    """
+    Loads the metrics recorded before the monitor's restart from the snapshot
+    file and starts saving the metrics to it.
+    """
+
+    global _SNAPSHOT
+
+    if _SNAPSHOT is not None:
+        raise Error("The snapshot is already loaded.")
+
+    try:
+        snapshot = Snapshot(path, constants.STATS_SNAPSHOT_CAPACITY)
+    except Exception as e:
+        LOG.error("%s The metrics won't survive the monitor's restart.", e)
+        return
+
+    metrics = 0
+
+    for host, name, value_time, value in snapshot.get_records():
+        if host in config.HOSTS:
+            _METRICS.setdefault(host, {})[name] = { "time": int(value_time), "value": value }
+            metrics += 1
+        else:
+            snapshot.remove(host, name)
+
+    LOG.info("Loaded %s metrics from %s.", metrics, path)
+
+    _SNAPSHOT = snapshot
+
+
+def add_metric(host, name, value, value_time=None):
+    """Adds a new metric value received at value_time (now if it's None)."""
+
+    if value_time is None:
+        value_time = time.time()
+
+    metrics = _METRICS.setdefault(host, {})
+    metric = metrics.get(name)
+
+    if metric is None:
+        metrics[name] = { "time": int(value_time), "value": value }
+    else:
+        metric["time"] = int(value_time)
+        metric["value"] = value
+
+    history = _HISTORY.setdefault(host, {}).get(name)
+    if history is None:
+        history = _HISTORY[host][name] = _MetricHistory(
+            constants.METRIC_HISTORY_SIZE, config.AGGREGATE_WINDOWS)
+
+    history.add(value_time, value)
+
+    if _SNAPSHOT is not None:
+        _SNAPSHOT.update(host, name, value_time, value)
 
 
 def get_metrics(host):
@@ -53,3 +428,112 @@ def get_metrics(host):
         raise Error("Unknown host {0}.", host)
 
     return _METRICS.get(host, {})
+
+
+def get_history(host, name, window=None):
+    """
+    Returns a list of (time, value) pairs of the metric values recorded over
+    the last window seconds (all recorded values if window is None).
+    """
+
+    if host not in config.HOSTS:
+        raise Error("Unknown host {0}.", host)
+
+    history = _HISTORY.get(host, {}).get(name)
+    if history is None:
+        return []
+
+    return history.get_values(None if window is None else time.time() - window)
+
+
+def get_aggregate(host, name, window):
+    """
+    Returns count, min, max and avg of the metric values recorded over the
+    last window seconds. The aggregates are exact for config.AGGREGATE_WINDOWS
+    and are calculated from the rollups (see ROLLUP_TIERS) for other windows -
+    in this case resolution of the used rollup is returned.
+    """
+
+    if host not in config.HOSTS:
+        raise Error("Unknown host {0}.", host)
+
+    resolution = (
+        None if window in config.AGGREGATE_WINDOWS
+        else ROLLUP_TIERS[_get_rollup_tier(window)][0])
+
+    history = _HISTORY.get(host, {}).get(name)
+    if history is None:
+        return { "window": window, "resolution": resolution, "count": 0,
+                 "min": None, "max": None, "avg": None }
+
+    return history.get_aggregate(window, time.time())
+
+
+
+def _get_rollup_tier(window):
+    """
+    Returns index of the finest rollup tier in ROLLUP_TIERS which spans the
+    window.
+    """
+
+    for tier, (resolution, buckets) in enumerate(ROLLUP_TIERS):
+        if window <= resolution * buckets:
+            return tier
+
+    raise Error("Unsupported window: {0}. The maximum window is {1} seconds.",
+        window, max(resolution * buckets for resolution, buckets in ROLLUP_TIERS))
+
+
+
+def add_frame(frame_type):
+    """Counts a received frame of the specified type."""
+
+    frames = _RADIO_STATS["frames"]
+    frames[frame_type] = frames.get(frame_type, 0) + 1
+
+
+def add_modem_status(status):
+    """Records a modem status."""
+
+    stats = _RADIO_STATS["modem_status"].setdefault(status, { "count": 0 })
+    stats["count"] += 1
+    stats["time"] = int(time.time())
+
+
+def add_tx_status(delivery_status, retry_count):
+    """Records a transmit status."""
+
+    stats = _RADIO_STATS["tx_status"].setdefault(delivery_status, {
+        "count":   0,
+        "retries": 0,
+    })
+    stats["count"] += 1
+    stats["retries"] += retry_count
+
+
+def add_rx_packet(source, size):
+    """Records a received packet."""
+
+    stats = _RADIO_STATS["rx_packets"].setdefault(source, {
+        "packets": 0,
+        "bytes":   0,
+    })
+    stats["packets"] += 1
+    stats["bytes"] += size
+    stats["time"] = int(time.time())
+
+
+def add_at_response(source, command, status, value):
+    """Records an AT command response."""
+
+    _RADIO_STATS["at_responses"].setdefault(source, {})[command] = {
+        "time":   int(time.time()),
+        "status": status,
+        "value":  value,
+    }
+
+
+def get_radio_stats():
+    """Returns radio traffic statistics."""
+
+    return _RADIO_STATS
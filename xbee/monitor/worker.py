@@ -0,0 +1,477 @@
+"""Reads XBee devices in separate worker processes.
+
+Each worker process reads one device and sends decoded IO samples to the
+monitor through a pipe of fixed-size binary records. Raw frames (for the frame
+recorder and for handling of frames other than IO samples in the monitor) and
+the worker's sensor statistics are sent as records followed by variable-size
+data. The monitor restarts workers that exit unexpectedly.
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import array
+import errno
+import fcntl
+import json
+import logging
+import os
+import signal
+import struct
+import subprocess
+import sys
+import time
+
+from functools import partial
+
+from psys import eintr_retry
+
+import xbee.common.log
+from xbee import common
+from xbee.common.core import Error
+from xbee.common.io_loop import FileObject, IoLoop, PRIORITY_HIGH
+
+import xbee.monitor.config
+import xbee.monitor.sensor
+import xbee.monitor.stats
+from xbee import monitor
+from xbee.monitor.frame import FRAME_TYPE_IO_SAMPLE, FRAME_TYPE_NAMES, InvalidFrameError
+from xbee.monitor.recorder import FrameRecorder
+
+xbee # Suppress PyFlakes warnings
+
+
+_RECORD = struct.Struct(b"!dQBBH")
+"""Record: time, source address, record type, channel, value."""
+
+_RECORD_ANALOG = 0
+"""Analog sample record (channel and value are set)."""
+
+_RECORD_DIGITAL = 1
+"""Digital sample record (channel and value are set)."""
+
+_RECORD_FRAME = 2
+"""
+Received frame record (channel is the frame type, value is the size of the
+frame data that follows the record).
+"""
+
+_RECORD_END = 3
+"""End of IO sample frame record (address is set)."""
+
+_RECORD_STATS = 4
+"""
+Sensor statistics record (value is the size of JSON-encoded statistics that
+follow the record).
+"""
+
+_DATA_RECORDS = (_RECORD_FRAME, _RECORD_STATS)
+"""Records that are followed by data."""
+
+_STATS_INTERVAL = 5
+"""Interval at which workers send their sensor statistics."""
+
+_RESTART_DELAY = 5
+"""Delay before restarting a worker that has exited unexpectedly."""
+
+LOG = logging.getLogger("xbee.monitor.worker" if __name__ == "__main__" else __name__)
+
+
+class _Worker(FileObject):
+    """Represents a worker process (the monitor's side)."""
+
+    edge_triggered = True
+
+    priority = PRIORITY_HIGH
+
+    workers = {}
+    """Running workers."""
+
+    starting = set()
+    """Devices for which workers are being started."""
+
+    restarts = {}
+    """Device -> deferred restart call mappings of the exited workers."""
+
+
+    def __init__(self, io_loop, device, process):
+        # process is a started worker process (see _spawn())
+
+        try:
+            super(_Worker, self).__init__(io_loop, process.stdout,
+                "{0} worker (pid {1})".format(device, process.pid))
+        except:
+            process.kill()
+            process.wait()
+            raise
+
+        self.__device = device
+        self.__process = process
+        self.__eof = False
+
+        # Whether the worker has been stopped by us
+        self.__stopped = False
+
+        # Samples of the current IO sample frame
+        self.__digital = {}
+        self.__analog = {}
+
+        # The last frames received by the worker and its last sensor
+        # statistics
+        self.__recorder = FrameRecorder()
+        self.__stats = { "device": device }
+
+        self.add_on_close_handler(self.__on_close)
+
+        try:
+            self._set_interest(read=True)
+            self.workers[device] = self
+        except:
+            self.close()
+            raise
+
+
+    def get_stats(self):
+        """Returns the last sensor statistics sent by the worker."""
+
+        return self.__stats
+
+
+    def dump_frames(self):
+        """Returns the last received frames (see FrameRecorder.dump())."""
+
+        return self.__recorder.dump()
+
+
+    def on_read(self):
+        """Called when we have data to read."""
+
+        eof = self._read_available()
+
+        view = self._read_buffer.view()
+        offset = 0
+
+        try:
+            while len(view) - offset >= _RECORD.size:
+                record = _RECORD.unpack_from(view, offset)
+                record_type, size = record[2], record[4]
+                data_offset = offset + _RECORD.size
+
+                if record_type in _DATA_RECORDS:
+                    if len(view) - data_offset < size:
+                        break
+
+                    data = bytearray(view[data_offset:data_offset + size])
+                    data_offset += size
+                else:
+                    data = None
+
+                offset = data_offset
+
+                try:
+                    self.__handle_record(data, *record)
+                except InvalidFrameError as e:
+                    LOG.error("Error while processing a frame from %s: %s", self, e)
+        finally:
+            del view
+            self._read_buffer.consume(offset)
+
+        if eof:
+            LOG.debug("%s has closed its output.", self)
+            self.__eof = True
+            self.close()
+
+
+    def stop(self):
+        """Called when the I/O loop ends its work."""
+
+        self.__stopped = True
+        self.close()
+
+
+    def __handle_record(self, data, record_time, address, record_type, channel, value):
+        """Handles a record (data is the data that follows the record)."""
+
+        if record_type == _RECORD_ANALOG:
+            samples = self.__analog.get(channel)
+            if samples is None:
+                samples = self.__analog[channel] = array.array(str("H"))
+            samples.append(value)
+        elif record_type == _RECORD_DIGITAL:
+            samples = self.__digital.get(channel)
+            if samples is None:
+                samples = self.__digital[channel] = array.array(str("B"))
+            samples.append(value)
+        elif record_type == _RECORD_END:
+            digital, analog = self.__digital, self.__analog
+            self.__digital, self.__analog = {}, {}
+            monitor.sensor.handle_io_sample(address, digital, analog, record_time)
+        elif record_type == _RECORD_FRAME:
+            self.__recorder.record(data, record_time)
+
+            if channel == FRAME_TYPE_IO_SAMPLE:
+                # The worker sends decoded samples of IO sample frames
+                monitor.stats.add_frame(FRAME_TYPE_NAMES[channel])
+            else:
+                monitor.sensor.handle_frame(self, channel, data)
+        elif record_type == _RECORD_STATS:
+            self.__stats = json.loads(bytes(data).decode("utf-8"))
+        else:
+            LOG.error("%s sent an invalid record type: %s.", self, record_type)
+
+
+    def __on_close(self):
+        """Called when the object is closed."""
+
+        if self.workers.get(self.__device) is self:
+            del self.workers[self.__device]
+
+        process = self.__process
+
+        # The process closes its output only on exit
+        if not self.__eof and process.poll() is None:
+            LOG.debug("Terminating %s...", self)
+
+            try:
+                process.terminate()
+            except EnvironmentError as e:
+                if e.errno != errno.ESRCH:
+                    LOG.error("Failed to terminate %s: %s.", self, e)
+
+        io_loop = self._weak_io_loop()
+        on_exited = partial(_on_worker_exited, io_loop, self.__device, str(self), self.__stopped)
+
+        try:
+            io_loop.run_in_executor(process.wait, on_exited)
+        except Exception:
+            # The I/O loop is closed or stopping
+            on_exited(process.wait(), None)
+
+
+
+class _WorkerSensor(monitor.sensor._Sensor):
+    """
+    A sensor that sends received frames, decoded IO samples and its statistics
+    to the monitor.
+    """
+
+    def __init__(self, io_loop, device, port, output_fd):
+        super(_WorkerSensor, self).__init__(io_loop, device, port)
+
+        # Output file descriptor
+        self.__output_fd = output_fd
+
+        # Records that haven't been sent yet
+        self.__records = bytearray()
+
+        self.__deferred_call = io_loop.call_next(self.__send_stats)
+        self.add_on_close_handler(self.__on_close)
+
+
+    def on_read(self):
+        """Called when we have data to read."""
+
+        try:
+            super(_WorkerSensor, self).on_read()
+        finally:
+            self.__flush()
+
+
+    def _on_frame(self, frame_type, frame):
+        """Called on each received frame."""
+
+        self.__records += _RECORD.pack(time.time(), 0, _RECORD_FRAME, frame_type, len(frame))
+        self.__records += frame
+
+        # Other frames are handled by the monitor
+        if frame_type == FRAME_TYPE_IO_SAMPLE:
+            monitor.sensor.handle_frame(self, frame_type, frame)
+
+
+    def _on_io_sample(self, address, digital, analog):
+        """Called on each received IO sample frame."""
+
+        records = self.__records
+        record_time = time.time()
+
+        for channel, samples in analog.items():
+            for value in samples:
+                records += _RECORD.pack(record_time, address, _RECORD_ANALOG, channel, value)
+
+        for channel, samples in digital.items():
+            for value in samples:
+                records += _RECORD.pack(record_time, address, _RECORD_DIGITAL, channel, value)
+
+        records += _RECORD.pack(record_time, address, _RECORD_END, 0, 0)
+
+
+    def __send_stats(self):
+        """Sends the sensor statistics."""
+
+        self.__deferred_call = self._weak_io_loop().call_after(
+            _STATS_INTERVAL, self.__send_stats)
+
+        try:
+            stats = json.dumps(self.get_stats()).encode("utf-8")
+            if len(stats) > 0xFFFF:
+                raise Error("The statistics are too big ({0} bytes).", len(stats))
+
+            self.__records += _RECORD.pack(time.time(), 0, _RECORD_STATS, 0, len(stats))
+            self.__records += stats
+            self.__flush()
+        except Exception as e:
+            LOG.error("Failed to send %s statistics: %s", self, e)
+            self.close()
+
+
+    def __on_close(self):
+        """Called when the object is closed."""
+
+        io_loop = self._weak_io_loop()
+        if io_loop is not None:
+            io_loop.cancel_call(self.__deferred_call)
+
+
+    def __flush(self):
+        """Sends the pending records (blocking)."""
+
+        records = memoryview(self.__records)
+
+        try:
+            while records:
+                records = records[eintr_retry(os.write)(self.__output_fd, records):]
+        finally:
+            del records
+            del self.__records[:]
+
+
+
+def start(io_loop, device):
+    """Starts a worker for the specified device if it's not running yet.
+
+    The worker process is started in the I/O loop's thread pool.
+    """
+
+    if device in _Worker.workers or device in _Worker.starting or io_loop.stopping():
+        return
+
+    LOG.info("Starting a worker for %s...", device)
+
+    _Worker.starting.add(device)
+    io_loop.run_in_executor(partial(_spawn, device),
+        partial(_on_worker_spawned, io_loop, device))
+
+
+def stop(io_loop):
+    """Cancels the pending worker restarts (called on the I/O loop stop)."""
+
+    for call in _Worker.restarts.values():
+        io_loop.cancel_call(call)
+
+    _Worker.restarts.clear()
+
+
+def _spawn(device):
+    """Starts a worker process for the specified device (blocking)."""
+
+    command = [ sys.executable, "-m", "xbee.monitor.worker", device ]
+    if LOG.isEnabledFor(logging.DEBUG):
+        command.append("--debug")
+
+    with open(os.devnull, "rb") as devnull:
+        process = subprocess.Popen(command,
+            stdin=devnull, stdout=subprocess.PIPE, close_fds=True)
+
+    try:
+        fcntl.fcntl(process.stdout, fcntl.F_SETFL,
+            fcntl.fcntl(process.stdout, fcntl.F_GETFL) | os.O_NONBLOCK)
+    except:
+        process.kill()
+        process.wait()
+        raise
+
+    return process
+
+
+def _on_worker_spawned(io_loop, device, process, error):
+    """Called when a worker process starting completes."""
+
+    _Worker.starting.discard(device)
+
+    if error is not None:
+        LOG.error("Failed to start a worker for %s: %s", device, error)
+        return
+
+    try:
+        worker = _Worker(io_loop, device, process)
+    except Exception as e:
+        LOG.error("Failed to start a worker for %s: %s", device, e)
+        return
+
+    if io_loop.stopping():
+        worker.stop()
+
+
+def _on_worker_exited(io_loop, device, name, stopped, status, error):
+    """Called when a worker process exits."""
+
+    if error is not None:
+        LOG.error("Failed to wait for %s: %s", name, error)
+        return
+
+    if stopped:
+        LOG.debug("%s has been stopped.", name)
+        return
+
+    if status:
+        LOG.error("%s has crashed (exit status %s).", name, status)
+    else:
+        LOG.info("%s has exited.", name)
+
+    if io_loop is None or io_loop.stopping():
+        return
+
+    def restart():
+        _Worker.restarts.pop(device, None)
+
+        if os.path.exists(device):
+            start(io_loop, device)
+        else:
+            LOG.debug("%s has been disconnected. Don't restart its worker.", device)
+
+    if device not in _Worker.restarts:
+        _Worker.restarts[device] = io_loop.call_after(_RESTART_DELAY, restart)
+
+
+def main():
+    """The worker process' main function."""
+
+    parser = argparse.ArgumentParser(description="XBee monitor worker")
+    parser.add_argument("device", help="XBee device path")
+    parser.add_argument("-d", "--debug", action="store_true",
+        help="print debug messages")
+
+    args = parser.parse_args()
+
+    # The monitor stops us via SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    try:
+        monitor.config.load()
+        common.log.setup("xbee-monitor-worker", debug_mode=args.debug)
+    except Exception as e:
+        sys.exit("Unable to start the worker: {0}".format(e))
+
+    try:
+        port = monitor.sensor._open(args.device)
+
+        with IoLoop() as io_loop:
+            _WorkerSensor(io_loop, args.device, port, sys.stdout.fileno())
+            io_loop.start()
+    except Exception as e:
+        LOG.error("The worker for %s has crashed: %s", args.device, e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
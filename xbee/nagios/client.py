@@ -4,25 +4,118 @@ from __future__ import unicode_literals
 
 import errno
 import json
+import os
 import socket
 import struct
+import time
 
 from psys import eintr_retry
 
 from xbee.common import constants
 from xbee.common.core import Error, LogicalError
+from xbee.common.snapshot import read_snapshot
 
 
 def metrics(host):
-    """Returns metrics for the specified host."""
+    """Returns metrics for the specified host.
 
-    return _send("metrics", { "host": host })
+    The metrics are read from the monitor's stats snapshot if it's available.
+    Note: in this case an unknown host has no metrics instead of being an
+    error.
+    """
+
+    snapshot = _read_snapshot()
+
+    if snapshot is None:
+        return _send("metrics", { "host": host })
+
+    start_time, records = snapshot
+
+    return dict(
+        (name, { "time": int(value_time), "value": value })
+        for record_host, name, value_time, value in records if record_host == host)
+
+
+def history(host, metric, window=None):
+    """
+    Returns (time, value) pairs of the metric values recorded over the last
+    window seconds (all recorded values if window is None).
+    """
+
+    request = { "host": host, "metric": metric }
+    if window is not None:
+        request["window"] = str(window)
+
+    return _send("history", request)
+
+
+def aggregate(host, metric, window):
+    """
+    Returns count, min, max and avg of the metric values recorded over the
+    last window seconds.
+    """
+
+    return _send("aggregate", { "host": host, "metric": metric, "window": str(window) })
 
 
 def uptime():
     """Returns monitor service uptime."""
 
-    return _send("uptime")
+    snapshot = _read_snapshot()
+
+    if snapshot is None:
+        return _send("uptime")
+
+    start_time, records = snapshot
+    return int(time.time() - start_time)
+
+
+def radio_stats():
+    """Returns the monitor's radio traffic statistics."""
+
+    return _send("radio_stats")
+
+
+def loop_stats():
+    """Returns the monitor's I/O loop statistics."""
+
+    return _send("loop_stats")
+
+
+def sensor_stats():
+    """Returns statistics of the monitor's sensors."""
+
+    return _send("sensor_stats")
+
+
+def dump_frames():
+    """Returns the last frames received by the monitor's sensors."""
+
+    return _send("dump_frames")
+
+
+def _read_snapshot():
+    """
+    Reads the monitor's stats snapshot. Returns a (monitor's start time,
+    records) tuple (see xbee.common.snapshot.read_snapshot()) or None if the
+    snapshot is not available or is not published by a running monitor.
+    """
+
+    try:
+        pid, start_time, records = read_snapshot(constants.STATS_SNAPSHOT_PATH)
+    except Error:
+        return
+
+    if not pid:
+        return
+
+    try:
+        os.kill(pid, 0)
+    except EnvironmentError as e:
+        if e.errno == errno.ESRCH:
+            return
+
+    return start_time, records
 
 
 def _send(method, request=None):
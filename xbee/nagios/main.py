@@ -33,6 +33,9 @@ _STATUS_UNKNOWN = "UNKNOWN"
 _METRIC_TIMEOUT = 10
 """Timeout for metric values."""
 
+_AGGREGATES = ("avg", "min", "max")
+"""Supported aggregates of metric values over a time window."""
+
 
 class _RangeFormatError(Error):
     """Raised on range format error."""
@@ -57,11 +60,24 @@ def main():
         parser.add_argument("-c", "--critical", metavar="VALUE",
             help="critical threshold", required=True)
 
+        parser.add_argument("--window", metavar="SECONDS", type=int,
+            help="check an aggregate of the metric values over the time window "
+                 "(exact for the monitor's AGGREGATE_WINDOWS, otherwise rounded up "
+                 "to 1 minute up to an hour, to 5 minutes up to a day and to an hour "
+                 "up to a week)")
+
+        parser.add_argument("--aggregate", choices=_AGGREGATES, default=_AGGREGATES[0],
+            help="aggregate to check with --window (default: %(default)s)")
+
         args = parser.parse_args()
 
         if args.metric == "temperature":
-            _check_and_response(_get_temperature(args.host),
-                args.warning, args.critical)
+            if args.window is None:
+                value = _get_temperature(args.host)
+            else:
+                value = _get_aggregate(args.host, args.metric, args.window, args.aggregate)
+
+            _check_and_response(value, args.warning, args.critical)
         else:
             raise LogicalError()
     except Exception as e:
@@ -87,6 +103,21 @@ def _get_temperature(host):
             _response(_STATUS_CRITICAL, "No data")
 
 
+def _get_aggregate(host, metric, window, aggregate):
+    """
+    Returns an aggregate of the metric values over the last window seconds.
+    """
+
+    stats = nagios.client.aggregate(host, metric, window)
+
+    if stats["count"]:
+        return stats[aggregate]
+    elif nagios.client.uptime() < _METRIC_TIMEOUT:
+        _response(_STATUS_UNKNOWN, "Not collected yet")
+    else:
+        _response(_STATUS_CRITICAL, "No data for the last {0} seconds", window)
+
+
 def _check_and_response(value, warning, critical):
     """Checks a value and responds with an appropriate code."""
 